@@ -0,0 +1,60 @@
+# coding=utf-8
+
+""" Замер времени запуска скриптов и импорта модулей: с отложенными импортами (как по умолчанию)
+    и с обычными (RUS_TERM_EAGER_IMPORTS=1, см. lazy_import.py).
+
+    $ python bench_startup.py -n 7
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def main_run_eagerly(*argv):
+    """ -> аргументы интерпретатора для запуска main_run.py так, как до отложенных импортов
+        (он начинался с `from text_utils import *`) """
+    return ['-c', "import sys, runpy, text_utils; sys.argv = %r; runpy.run_path('main_run.py', run_name='__main__')"
+            % (['main_run.py'] + list(argv))]
+
+# что замеряем: (название, аргументы интерпретатора, аргументы для режима eager - если отличаются)
+COMMANDS = [
+    ('main_run.py --help', ['main_run.py', '--help'], main_run_eagerly('--help')),
+    ('main_run.py (bad args)', ['main_run.py', 'none.txt', '-m', '0'], main_run_eagerly('none.txt', '-m', '0')),
+    ('import text_utils', ['-c', 'import text_utils'], None),
+    ('import definition_pattern', ['-c', 'import definition_pattern'], None),
+    ('import booklet', ['-c', 'import booklet'], None),
+]
+
+
+def run_time(args, env):
+    " -> время (сек) одного запуска интерпретатора с аргументами args "
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    return time.perf_counter() - start
+
+
+def median_time(args, eager, repeat):
+    env = dict(os.environ)
+    env.pop('RUS_TERM_EAGER_IMPORTS', None)
+    if eager:
+        env['RUS_TERM_EAGER_IMPORTS'] = '1'
+    return statistics.median(run_time(args, env) for _ in range(repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure startup time with lazy and eager imports')
+    parser.add_argument("--repeat", "-n", default=5, type=int, help="Runs per measurement (default: 5)")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    median_time(['-c', 'pass'], False, 1)  # прогреть файловый кеш
+
+    print('%-28s %10s %10s %8s' % ('command', 'eager, ms', 'lazy, ms', 'gain'))
+    for title, cmd, eager_cmd in COMMANDS:
+        eager = median_time(eager_cmd or cmd, True, args.repeat)
+        lazy = median_time(cmd, False, args.repeat)
+        print('%-28s %10.0f %10.0f %7.1fx' % (title, eager * 1000, lazy * 1000, eager / lazy))
@@ -1,13 +1,47 @@
 # coding=utf-8
 
 import itertools
+import multiprocessing
+
+import numpy as np
 
 from text_utils import *
-from extract_terms import copyTerm
+import text_utils as te
+from term_matcher import TermMatcher
+from text_index import TextIndex, SENTENCE_SHIFT
+from profiles import bin_sentences, compress_matrix_by_bins, stdev_ranks, term_lengths
+from extract_terms import copyTerm, ExtractTerms
+from morphology import get_parse_cache
 
 STOPWORDS_PATH = './'+'text-corpus/stopwords.txt'
 
 
+# экземпляр ExtractTerms процесса-обработчика (см. `Booklet.prepare_terms(workers=...)`)
+_worker_extract_terms = None
+
+def _init_prepare_worker(stopwords_file):
+    global _worker_extract_terms
+    _worker_extract_terms = ExtractTerms(stopwords_file=stopwords_file)
+
+def _prepare_chapter_terms(source):
+    """ source - текст главы или список строк её предложений (если текст не сохранён, см. `Chapter.load_file`)
+        -> tuple(prepared terms (see `Chapter.export_prepared_terms`) or None, error message or None) """
+    ch = te.Chapter(extract_terms_instance=_worker_extract_terms)
+    try:
+        if isinstance(source, str):
+            ch.load_text(source)
+        else:
+            assert source and None not in source, "No text to extract terms from (was the Chapter loaded with keep_text=False and keep_lines=False?)"
+            ch._load_sentence_lines(source)
+        ch.prepare_terms(quiet=True)
+    except AssertionError as e:
+        return None, str(e) or 'AssertionError'
+    finally:
+        # обработчики пула завершаются без atexit: сохранить новые разборы в общий кеш
+        get_parse_cache().flush()
+    return ch.export_prepared_terms(), None
+
+
 def interleave_lists(*lists):
     """ Returns plain list of lists`s elements.
         Elements are positioned by each list`s order 
@@ -25,11 +59,13 @@ def interleave_lists(*lists):
 def merge_similar_terms(term_list, quiet=False):
     """ Простое слияние терминов с одинаковым .normalized полем. """ 
     res_list = []
-    term_set = set(term_list)
-    not quiet and print(len(term_set), 'unique terms out of', len(term_list), 'terms.')
-    for i,t in enumerate(term_set):
-        similar = [T for T in term_list if T==t]
-        not quiet and i%1000==0 and print(i,'.',str(t),":", list(map(str,similar)))
+    # группируем по .normalized словарём - за один проход
+    by_normalized = {}
+    for t in term_list:
+        by_normalized.setdefault(t.normalized, []).append(t)
+    not quiet and print(len(by_normalized), 'unique terms out of', len(term_list), 'terms.')
+    for i,similar in enumerate(by_normalized.values()):
+        not quiet and i%1000==0 and print(i,'.',str(similar[0]),":", list(map(str,similar)))
         if len(similar) == 1:
             res_list.append(similar[0])
         elif len(similar) > 1:
@@ -80,6 +116,8 @@ class Booklet(object):
     def __init__(self, ):
         self.chapter_list = []
         self.__term_candidates_cache = None
+        self.__index_cache = None
+        self.__count_matrix_cache = None
         
     def at(self, i):
         """ get chapter at index `i` """
@@ -100,7 +138,34 @@ class Booklet(object):
     def count_of(self, word):
         """return count of word(s) / term(s) found within sll chapters"""
         assert self.chapter_list
-        return sum([ch.count_of(word) for ch in self.chapter_list])
+        return self.get_index().count_of(word)
+        
+    def count_by_chapter(self, word):
+        """returns np.ndarray[int] - count of word(s) / term(s) for each chapter"""
+        assert self.chapter_list
+        # номера первых предложений глав в сквозной нумерации индекса
+        starts = np.cumsum([0] + [ch.size() for ch in self.chapter_list[:-1]])
+        sentences = self.get_index().postings(word) >> SENTENCE_SHIFT
+        ch_indices = np.searchsorted(starts, sentences, side='right') - 1
+        return np.bincount(ch_indices, minlength=self.size())
+        
+    def get_index(self):
+        """returns TextIndex (positional index) over all chapters with through numbering of sentences"""
+        if self.__index_cache is None:
+            self.__index_cache = TextIndex.merge([ch.get_index() for ch in self.chapter_list])
+        return self.__index_cache
+        
+    def get_count_matrix(self):
+        """returns TermCountMatrix (terms × sentences of all chapters) for all term candidates at once.
+            Row `i` corresponds to `get_term_candidates()[i]`."""
+        if self.__count_matrix_cache is None:
+            # все кандидаты ищутся за один проход по всем главам
+            vocabulary = self.chapter_list[0].vocabulary
+            assert all(ch.vocabulary is vocabulary for ch in self.chapter_list), "Chapters must share the same vocabulary"
+            matcher = TermMatcher(self.get_term_candidates(), vocabulary)
+            sentences = itertools.chain.from_iterable(ch.sentence_list for ch in self.chapter_list)
+            self.__count_matrix_cache = matcher.count_matrix(sentences)
+        return self.__count_matrix_cache
         
     def get_stopwords(self):
         """return set of stopwords"""
@@ -126,20 +191,51 @@ class Booklet(object):
             return
         ch.user_data = user_data
         self.chapter_list.append(ch)
+        self.__index_cache = None
+        self.__count_matrix_cache = None
+
+    def prepare_terms(self, workers=None):
+        """Extract nominal groups from the text for all chapters.
+            workers - number of processes to prepare chapters in parallel (default: prepare in this process)."""
+        if workers and workers > 1:
+            self._prepare_terms_parallel(workers)
+        elif self.chapter_list:
+            # один ExtractTerms на все главы: его кеш ответов про стоп-слова общий для всей книги
+            et_obj = self.chapter_list[0].get_extract_terms() or ExtractTerms(stopwords_file=STOPWORDS_PATH)
+            for ch in self.chapter_list[:]:
+                print(ch.title, "...")
+                try:
+                    ch.prepare_terms(stopwords_file=STOPWORDS_PATH, quiet=True, extract_terms_instance=et_obj)
+                except AssertionError as e:
+                    print('Warning: chapter %s is removed:' % ch.title, str(e) or 'AssertionError')
+                    self.chapter_list.remove(ch)
+        self.__index_cache = None
+        self.__count_matrix_cache = None
+
+    def _prepare_terms_parallel(self, workers):
+        """ Главы раздаются пулу процессов; каждый процесс загружает ExtractTerms (словари pymorphy2) один раз,
+            а назад возвращает кандидатов в термины и леммы слов главы в компактной форме. """
+        # (ExtractTerms загружает общий анализатор до создания пула: процессы разделяют его словари)
+        et_obj = self.chapter_list[0].get_extract_terms() or ExtractTerms(stopwords_file=STOPWORDS_PATH)
+        # без сохранённого текста глава передаётся строками предложений (как в `Chapter.prepare_term_candidates`)
+        sources = [ch.text  if ch.text else  [s.line for s in ch.sentence_list] for ch in self.chapter_list]
+        with multiprocessing.Pool(workers, initializer=_init_prepare_worker, initargs=(STOPWORDS_PATH,)) as pool:
+            prepared_list = list(pool.imap(_prepare_chapter_terms, sources))
 
-    def prepare_terms(self):
-        """Extract nominal groups from the text for all chapters"""
-        for ch in self.chapter_list[:]:
+        for ch, (prepared, error) in zip(self.chapter_list[:], prepared_list):
             print(ch.title, "...")
-            try:
-                ch.prepare_terms(stopwords_file=STOPWORDS_PATH, quiet=True)
-            except AssertionError:
+            if prepared is None:
+                print('Warning: chapter %s is removed:' % ch.title, error)
                 self.chapter_list.remove(ch)
+                continue
+            ch.import_prepared_terms(prepared, extract_terms_instance=et_obj)
 
     def clear_cache(self):
         " reset cached data if any for all chapters "
         for ch in self.chapter_list:
             ch.clear_cache()
+        self.__index_cache = None
+        self.__count_matrix_cache = None
     
     def get_term_candidates(self, limit=None):
         """return term candidates list optionally
@@ -174,7 +270,7 @@ class Booklet(object):
             попадут только те (Chapter`ы) с min_entries 
             и больше вхождений термина. """
         assert min_entries > 0
-        chs = [(ch, ch.count_of(term)) for ch in self.chapter_list]
+        chs = list(zip(self.chapter_list, self.count_by_chapter(term).tolist()))
         chs = [tpl for tpl in chs  if tpl[1] >= min_entries]
 #         Nword = self.count_of(term)
         Nword = sum([n for _,n in chs]) # этот термин по всей коллекции
@@ -206,9 +302,7 @@ class Booklet(object):
             t = term
         assert hasattr(t, "normalized") and hasattr(t, "words")
         
-        # find out 'parts' value for each chapter in the Booklet; Sum should be equal to parts param.
-        N_sents = self.sentence_count() # total count of sentences in the Booklet
-        parts4chs = [max(1, round(parts*ch.size()/N_sents)) for ch in self.chapter_list]
+        parts4chs = self.parts4chapters(parts)
         
         full_profile = pd.Series()
         for i,ch in enumerate(self.chapter_list):
@@ -222,16 +316,32 @@ class Booklet(object):
         del full_profile
         return rank
     
+    def parts4chapters(self, parts):
+        """ find out 'parts' value for each chapter in the Booklet; Sum should be equal to parts param. """
+        N_sents = self.sentence_count() # total count of sentences in the Booklet
+        return [max(1, round(parts*ch.size()/N_sents)) for ch in self.chapter_list]
+        
+    def compress_candidates(self, parts):
+        """ Сжать профили всех кандидатов в термины разом: каждый chapter даёт целое число частей
+            (как в `term_stdev_rank`), части глав идут подряд.
+            returns np.ndarray of shape (n_candidates, n_parts_total) """
+        bins = []
+        nbins = 0
+        for ch, ch_parts in zip(self.chapter_list, self.parts4chapters(parts)):
+            ch_bins, ch_nbins = bin_sentences(ch.word_offsets(), ch_parts)
+            bins.append(ch_bins + nbins)
+            nbins += ch_nbins
+        return compress_matrix_by_bins(self.get_count_matrix(), np.concatenate(bins), nbins)
+    
     def rank_candidates_stdev(self,parts=None, min_count=1):
         parts = parts or self.size()
         assert parts > 0, "Positive values only allowed. Provided: %d" % parts
 
-        ranks = []
-        for t in self.get_term_candidates():
-            if t.count < min_count or len(t.normalized) < 2:
-                continue
-            r = self.term_stdev_rank(t, parts)
-            ranks.append( (t, r) )
+        candidates = self.get_term_candidates()
+        # веса всех кандидатов - одной редукцией по матрице "термины × части"
+        stdevs = stdev_ranks(self.compress_candidates(parts), term_lengths(candidates))
+        ranks = [(t, r) for t,r in zip(candidates, stdevs.tolist())
+                 if t.count >= min_count and len(t.normalized) >= 2]
 
         ranks.sort(key=lambda e:-e[1])        
         return ranks
@@ -6,6 +6,8 @@ from text_utils import *
 from rule.rule_utils import get_definition_patterns_extended, T_LAT
 from extract_terms import copyTerm, makeTerm
 from eval_utils import Evaluator, are_patterns_match
+from morphology import get_shared_morph
+from term_matcher import TermMatcher
 
 DEF_PTT_PATH = 'rule/definition_patterns.txt'
 
@@ -22,9 +24,10 @@ def normalize_pattern(def_ptt):
     
 ev = None
 
-def init_module(morph):
+def init_module(morph=None):
+    " morph - анализатор pymorphy2 (по умолчанию общий анализатор процесса, см. `morphology.get_shared_morph`) "
     global ev
-    ev = Evaluator(morph=morph)
+    ev = Evaluator(morph=morph or get_shared_morph())
 
 def lemmatize_def_ptt(def_ptt):
     assert ev, "Run `init_module(morph)` with Pymorphy2.Parser instance first!"
@@ -198,15 +201,19 @@ def match_terms_against_chapter(chapter, filled_def_ptts):
     
     match_list = []  # elem: (term_as_used, pattern_context_as_used)
     
+    # все шаблоны ищутся за один проход по каждому предложению
+    matcher = TermMatcher(filled_def_ptts, chapter.vocabulary)
     for s in chapter.sentence_list:
-        for t in filled_def_ptts:
-            for words in s.match_term(t):
-                if hasattr(t, "term_inidices"):
-                    # известна раскладка терминов в паттерне
-                    for st,end in t.term_inidices:
-                        match_list.append( (words[st:end], words) )
-                else:
-                    match_list.append( (words, "<same-context>") )
+        word_list = s.word_list
+        for t_i, p in matcher.scan_sentence(s):
+            t = filled_def_ptts[t_i]
+            words = tuple(word_list[p:p + matcher.lengths[t_i]])
+            if hasattr(t, "term_inidices"):
+                # известна раскладка терминов в паттерне
+                for st,end in t.term_inidices:
+                    match_list.append( (words[st:end], words) )
+            else:
+                match_list.append( (words, "<same-context>") )
     return match_list
 
 
@@ -4,7 +4,7 @@ from collections import namedtuple
 import pickle
 import re
 
-import pymorphy2
+from morphology import get_parse_cache, get_shared_morph, LRUCache, MORPH_CACHE_MAXSIZE
 
  
 EvalData = namedtuple('EvalData', 'name test ranked alg title expert')
@@ -143,25 +143,31 @@ class Evaluator(object):
         self.pymorphy2_morph = None # синглтон для анализатора (не нужно загружать, если не будем использовать)
         self.set_morph(morph)
         
-        self._lemma_pattern_cache = {}
+        self._lemma_pattern_cache = LRUCache(MORPH_CACHE_MAXSIZE)
         self._relevance_cache = {}
         
 
     def set_morph(self, morph):
         if morph and hasattr(morph, 'parse'):
             self.pymorphy2_morph = morph
-        else:
+        elif morph is not None:  # без анализатора будет использован общий (см. get_morph)
             print("Warning. Evaluator.set_morph(): invalid morph object! Provided: %s" % str(type(morph)))
             
     def get_morph(self):
         if not self.pymorphy2_morph:
-            self.pymorphy2_morph = pymorphy2.MorphAnalyzer() # загрузить анализатор
+            self.pymorphy2_morph = get_shared_morph() # общий анализатор процесса
         return self.pymorphy2_morph
 
-    def clear_cahe(self):
+    def clear_cache(self):
         self._lemma_pattern_cache.clear()
         self._relevance_cache.clear()
 
+    clear_cahe = clear_cache  # прежнее имя
+
+    def cache_stats(self):
+        " -> dict: статистика кеша lemma_pattern (hits, misses, evictions, size, maxsize) "
+        return self._lemma_pattern_cache.stats()
+
     def lemma_pattern(self, word):
         """
         lemma_pattern(word) -> tuple of sets(each set of lemmas)
@@ -173,11 +179,12 @@ class Evaluator(object):
             Каждое множество (set) содержит вероятные начальные формы слова.
         """
 
-        if word in self._lemma_pattern_cache:
-            return self._lemma_pattern_cache[word]
+        lemmas_tuple = self._lemma_pattern_cache.get(word)
+        if lemmas_tuple is not None:
+            return lemmas_tuple
         
         # гипотезы морфологического разбора
-        hyps = [self.get_morph().parse(str(w)) for w in word.split()]
+        hyps = [get_parse_cache(self.get_morph()).parse(str(w)) for w in word.split()]
         # кортеж из множеств лемм-гипотез
         lemmas_tuple = tuple([set([p.normal_form for p in hyp]) for hyp in hyps])
         # update cache
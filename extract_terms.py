@@ -1,13 +1,19 @@
 # coding=utf-8
 
 import math
+import multiprocessing
 
-from rutermextract import TermExtractor
-import rutermextract
-import pymorphy2
+from lazy_import import lazy_module
+from morphology import get_parse_cache, get_shared_morph, preload_morphology, LRUCache, MORPH_CACHE_MAXSIZE
+from vocabulary import get_shared_vocabulary
+
+rutermextract = lazy_module('rutermextract')  # загружается при создании первого ExtractTerms
 
 STOPWORDS_FILE = '../texts/' + 'stopwords.txt'
 
+# размер окна по умолчанию (в символах) для извлечения по окнам (см. `ExtractTerms.split_windows`)
+WINDOW_SIZE = 1 << 16
+
 
 class ExtractTerms(object):
     """
@@ -20,14 +26,27 @@ class ExtractTerms(object):
         
         stopwords_file = stopwords_file or STOPWORDS_FILE
         self.stopwords = stopwords or load_wordset(stopwords_file)
-        self.term_extractor = TermExtractor()
-        self.morph = self.term_extractor.parser.morph
-        self._morph_parse_cache = {}
+        self.morph = get_shared_morph()
+        self.term_extractor = make_term_extractor(self.morph)
+        self._morph_parse_cache = get_parse_cache(self.morph)  # общий кеш разборов (в памяти и на диске)
+        self._is_stopword_cache = LRUCache(MORPH_CACHE_MAXSIZE)  # словоформа -> bool
         
-    def __call__(self, text, limit=None, weight=None, strings=False, nested=False, quiet=False):
+    def __call__(self, text, limit=None, weight=None, strings=False, nested=False, quiet=False, window_size=None, workers=None,
+                 vocabulary=None):
+        """ text - строка или список предложений (строк).
+            window_size - извлекать по окнам примерно такого размера (в символах, см. `split_windows`):
+                результат тот же, что и для всего текста сразу, но память ограничена размером окна.
+                Список предложений всегда обрабатывается по окнам (по умолчанию WINDOW_SIZE).
+            workers - число процессов для окон (см. `extract_windows`).
+            vocabulary - словарь для id слов и лемм терминов (по умолчанию общий, см. `TermRecord`). """
         # call rutermextract
-        terms = self.term_extractor(text, limit=limit*2 if limit else limit,
-                                    weight=weight, strings=False, nested=nested)
+        if window_size or not isinstance(text, str):
+            terms = merge_terms(self.extract_windows(text, window_size or WINDOW_SIZE, nested=nested, workers=workers,
+                                                     vocabulary=vocabulary))
+            terms = self.term_extractor.ranker(terms, weight=weight)[:limit*2 if limit else limit]
+        else:
+            terms = self.term_extractor(text, limit=limit*2 if limit else limit,
+                                        weight=weight, strings=False, nested=nested)
 
         ###
         terms_out = len(terms) # print('before stopwords filtering:',len(terms))
@@ -43,7 +62,7 @@ class ExtractTerms(object):
         terms_out += len(terms)
         ###
 
-        joined_terms = self.join_terms(terms)
+        joined_terms = self.join_terms(terms, vocabulary)
 
         ###
         terms_out -= len(joined_terms)
@@ -60,63 +79,136 @@ class ExtractTerms(object):
         else:
             return result
 
+    def extract_windows(self, text, window_size=WINDOW_SIZE, nested=False, workers=None, vocabulary=None):
+        """ Извлечь кандидатов в термины (как rutermextract: без фильтрации и объединения) из каждого окна текста.
+            Результаты выдаются по мере готовности в порядке окон - их можно показывать, не дожидаясь конца текста,
+            и затем слить через `merge_terms`.
+            workers - число процессов (каждый со своим TermExtractor); термины из процессов - TermRecord.
+            yields list of terms for each window """
+        windows = self.split_windows(text, window_size)
+        if not workers or workers < 2:
+            for window in windows:
+                yield self.term_extractor(window, nested=nested)
+            return
+
+        preload_morphology()  # до fork: обработчики разделяют словари
+        with multiprocessing.Pool(workers, initializer=_init_window_worker) as pool:
+            for packed in pool.imap(_extract_window_terms, ((window, nested) for window in windows)):
+                yield [makeTerm(words=list(words), normalized=normalized, count=count, vocabulary=vocabulary)
+                       for normalized, words, count in packed]
+
+    def split_windows(self, text, window_size=WINDOW_SIZE):
+        """ Разделить текст (строку или список предложений) по границам предложений на окна не короче window_size символов.
+            Окно заканчивается только перед предложением, первое слово которого не может входить в термин
+            (глагол, предлог, союз...): через такую границу rutermextract не склеивает термины,
+            поэтому кандидаты всех окон вместе совпадают с кандидатами всего текста.
+            yields str """
+        if isinstance(text, str):
+            from text_utils import extract_sentences_from_text
+            text = extract_sentences_from_text(text)
+        window = []
+        size = 0
+        for sentence in text:
+            if size >= window_size and self._resets_terms(sentence):
+                yield ' '.join(window)
+                window = []
+                size = 0
+            window.append(sentence)
+            size += len(sentence) + 1
+        if window:
+            yield ' '.join(window)
+
+    def _resets_terms(self, sentence):
+        " -> True, если первое слово предложения обрывает термин для rutermextract (не сущ., прил., прич., число, латиница) "
+        for chunk in sentence.split():
+            tokens = self.term_extractor.tokenizer(chunk)
+            if tokens:
+                word = self.term_extractor.parser(tokens[0])
+                return not word or not (word.is_noun() or word.is_adjective() or word.is_participle()
+                                        or word.is_number() or word.is_latin())
+        return False
+
+    def extract_many(self, texts, workers=None, ordered=True, chunksize=None, **kwargs):
+        """ Извлечь термины из многих текстов (например, статей корпуса - см. `corpus_utils`).
+            workers - число процессов (каждый один раз создаёт свой ExtractTerms с TermExtractor);
+                по умолчанию тексты обрабатываются по очереди в текущем процессе.
+            ordered - выдавать результаты в порядке текстов; иначе - по мере готовности.
+            chunksize - сколько текстов передавать процессу за раз (мелкие документы выгоднее группировать);
+                по умолчанию - около четверти доли каждого процесса, если известно число текстов.
+            kwargs - параметры `__call__` (limit, weight, strings, nested; quiet по умолчанию True).
+            yields tuples (index of text, result of `__call__` for the text) """
+        kwargs.setdefault('quiet', True)
+        if not workers or workers < 2:
+            for i, text in enumerate(texts):
+                yield i, self(text, **kwargs)
+            return
+
+        if chunksize is None:
+            chunksize = max(1, len(texts) // (workers * 4))  if hasattr(texts, '__len__') else  1
+        preload_morphology()  # до fork: обработчики разделяют словари
+        with multiprocessing.Pool(workers, initializer=_init_extract_worker, initargs=(self.stopwords, kwargs)) as pool:
+            yield from (pool.imap  if ordered else  pool.imap_unordered)(_extract_terms_of, enumerate(texts), chunksize)
+
     def filter_by_stopwords(self, terms):
+        """ Убрать (на месте) кандидатов, хотя бы одно слово которых - стоп-слово
+            или имеет стоп-слово среди лемм-гипотез. """
         if not self.stopwords:
             return terms
-            
-        words_to_remove_cache = set()
-
-        for t in terms[:]: # make shallow copy to avoid deletion bugs
-            should_remove = False
-            t_words = set( t.normalized.split() + [str(word) for word in t.words] )
-            if t_words.intersection(words_to_remove_cache): # not empty
-                should_remove = True
-            elif t_words.intersection(self.stopwords): # not empty
-                should_remove = True
-            else:
-                # гипотезы морфологического разбора
-                for word in t_words:
-                    hyps = self.morph.parse(word)
-                    # множество лемм-гипотез
-                    lemmas_set = {p.normal_form for p in hyps}
-                    common_stops = lemmas_set.intersection(self.stopwords)
-                    if common_stops: # not empty
-                        words_to_remove_cache.add(word)
-                        words_to_remove_cache.update(lemmas_set)
-                        should_remove = True
-                        break
-
-            if should_remove:
-                # убираем неподходящего кандидата из списка
-                # # print('mathes stopword :', t.normalized, '; set:', t_words)
-                terms.remove( t )
-
-        words_to_remove_cache.clear()
+
+        is_stopword = self.is_stopword
+        terms[:] = [t for t in terms
+                    if not any(map(is_stopword, {*t.normalized.split(), *map(str, t.words)}))]
         return terms
 
-    def join_terms(self, terms):
-        "-> joined (by case, multiplicity, ...) and filtered terms list"
+    def is_stopword(self, word):
+        """ Является ли словоформа стоп-словом (сама или по одной из лемм-гипотез).
+            Ответы запоминаются для всех текстов (не более MORPH_CACHE_MAXSIZE словоформ, LRU). """
+        answer = self._is_stopword_cache.get(word)
+        if answer is None:
+            if word in self.stopwords:
+                answer = True
+            else:
+                # гипотезы морфологического разбора
+                hyps = self.morph_parse(word)
+                answer = any(p.normal_form in self.stopwords for p in hyps)
+            self._is_stopword_cache[word] = answer
+        return answer
+
+    def join_terms(self, terms, vocabulary=None):
+        "-> joined (by case, multiplicity, ...) and filtered terms list (TermRecord, ids in `vocabulary`)"
+
+        def factors4tag(morph_tag):
+            # не-слово: None, если [лат.буквы, пунктуация, число, не разобрано]
+            if any([gram in morph_tag for gram in {'LATN', 'PNCT', 'NUMB', "UNKN"}]):
+                return None
+
+            # часть речи: 1, если [сущ., полн. прил., полн. прич.] иначе 0
+            k_POS = int(morph_tag.POS in ('NOUN','ADJF','PRTF'))
+            # число: ед.
+            k_number = 5 if morph_tag.number == 'sing' else 1
+            # неодушевлëнность
+            k_inan = 5 if morph_tag.animacy == 'inan' else 0.75
+            # падеж: им.
+            k_case = 2 if morph_tag.case == 'nomn' else 1
+            return k_POS, k_number, k_inan, k_case
+
+        tag_factors = dict()  # тег -> множители оценки (None для не-слов)
 
         def lemma_pattern(term):
             "tuple of sets(each set of lemmas) , dict(lemma -> score for term)"
 
             def score4term(term, morph_tag):
-                # не-слово: -1, если [лат.буквы, пунктуация, число, не разобрано] иначе 1
-                if any([gram in morph_tag for gram in {'LATN', 'PNCT', 'NUMB', "UNKN"}]):
+                # множители оценки зависят только от тега - считаем их один раз на тег
+                k = tag_factors.get(morph_tag, tag_factors)
+                if k is tag_factors:
+                    k = tag_factors[morph_tag] = factors4tag(morph_tag)
+                if k is None:
                     return -1
-
-                # часть речи: 1, если [сущ., полн. прил., полн. прич.] иначе 0
-                k_POS = int(morph_tag.POS in ('NOUN','ADJF','PRTF'))
-                # число: ед.
-                k_number = 5 if morph_tag.number == 'sing' else 1
-                # неодушевлëнность
-                k_inan = 5 if morph_tag.animacy == 'inan' else 0.75
-                # падеж: им.
-                k_case = 2 if morph_tag.case == 'nomn' else 1
+                k_POS, k_number, k_inan, k_case = k
                 return math.log1p(term.count) * k_POS * k_number * k_inan * k_case
 
-            # гипотезы морфологического разбора
-            hyps = [self.morph_parse(str(word)) for word in term.words]
+            # гипотезы морфологического разбора (копии: ниже в них дописываются гипотезы, а кеш портить нельзя)
+            hyps = [list(self.morph_parse(str(word))) for word in term.words]
             # кортеж из множеств лемм-гипотез
             lemmas_tuple = tuple([set([p.normal_form for p in hyp]) for hyp in hyps])
             # добавить варианты разбора для итоговых лемм (чтобы ранжировалось не только по частным формам слов)
@@ -143,13 +235,12 @@ class ExtractTerms(object):
             return lemmas_tuple, scores
 
 
-        def are_patterns_match(ptt1, ptt2):
-            # совпадают длины и для каждого есть совпадающие (общие) леммы
-            return len(ptt1) == len(ptt2) and all([ptt1[i].intersection(ptt2[i]) for i in range(len(ptt1))])
-
-
         patterns = []
         joined = dict()
+        # инвертированный индекс: (длина фразы, лемма первого слова) -> номера объединений (в порядке создания).
+        # Совпадающие шаблоны обязательно имеют общую лемму в первой позиции,
+        #  поэтому полная проверка нужна только для объединений из этого индекса.
+        groups_by_lemma = dict()
         
         fake_terms_out = 0
 
@@ -160,12 +251,19 @@ class ExtractTerms(object):
 
             what2add = (t, lemma_scores) # текущий терм с его оценками по леммам
 
-            for p_i in joined:
-                if are_patterns_match(patterns[ptt_i],patterns[p_i]):
+            n = len(lemmas_pattern)
+            first_lemmas = lemmas_pattern[0] if n else (None,)  # пустые шаблоны совпадают друг с другом
+            candidates = {p_i for lemma in first_lemmas for p_i in groups_by_lemma.get((n, lemma), ())}
+
+            # первое подходящее объединение в порядке создания - как при переборе всех объединений
+            for p_i in sorted(candidates):
+                if lemma_patterns_match(patterns[ptt_i],patterns[p_i]):
                     joined[p_i].append(what2add) # добавить в объединение новый терм
                     break
             else: # no break
                 joined[ptt_i] = [what2add] # создать новое объединение из текущего терма
+                for lemma in first_lemmas:
+                    groups_by_lemma.setdefault((n, lemma), []).append(ptt_i)
 
         #     итоговый список
         judged_terms = list()
@@ -183,8 +281,7 @@ class ExtractTerms(object):
                     fake_terms_out += 1
                     continue
                 # дописать lemmas_pattern
-                base_term.lemmas = ptt
-                judged_terms.append(base_term)
+                judged_terms.append(TermRecord.from_term(base_term, lemmas=ptt, vocabulary=vocabulary))
             else:
                 # находим все леммы, общие для всех терминов в объединении (слив леммы фраз воедино)
                 ptt_intersection = {word for group in ptt for word in group}  # flatten set of lemmas
@@ -197,8 +294,8 @@ class ExtractTerms(object):
                         # убираем неподходящего кандидата из списка
                         joined_terms.remove( (t,t_lemma_scores) )
                         # добавляем этот терм отдельно
-                        t.lemmas = ({t.normalized},) # правильную лемму мы не знаем, поэтому - само слово
-                        judged_terms.append( t )
+                        # правильную лемму мы не знаем, поэтому - само слово
+                        judged_terms.append( TermRecord.from_term(t, lemmas=({t.normalized},), vocabulary=vocabulary) )
 #                         print(t.normalized,end='')
 #                         print('.')
                         continue
@@ -209,8 +306,8 @@ class ExtractTerms(object):
                     # добавляем все термы по отдельности
 #                     print('Can`t join (no common lemmas): ',end='\t')
                     for t,t_lemma_scores in joined_terms:
-                        t.lemmas = ({t.normalized},) # правильную лемму мы не знаем, поэтому - само слово
-                        judged_terms.append( t )
+                        # правильную лемму мы не знаем, поэтому - само слово
+                        judged_terms.append( TermRecord.from_term(t, lemmas=({t.normalized},), vocabulary=vocabulary) )
 #                         print(t.normalized,end=' , ')
 #                     print('.')
                     continue
@@ -229,14 +326,14 @@ class ExtractTerms(object):
                     # добавляем все термы по отдельности
 #                     print('Can`t join (zero max rank): ',end='\t')
                     for t,t_lemma_scores in joined_terms:
-                        t.lemmas = ({t.normalized},) # правильную лемму мы не знаем, поэтому - само слово
-                        judged_terms.append( t )
+                        # правильную лемму мы не знаем, поэтому - само слово
+                        judged_terms.append( TermRecord.from_term(t, lemmas=({t.normalized},), vocabulary=vocabulary) )
 #                         print(t.normalized,end=' , ')
 #                     print('.')
                     continue
 
                 # формируем лучший термин
-                base_term = copyTerm(joined_terms[max_rank_i][0])
+                base_term = copyTerm(joined_terms[max_rank_i][0], vocabulary)
                 # дописать lemmas_pattern
                 base_term.lemmas = ptt
                 sum_count = sum([t[0].count for t in joined_terms])
@@ -253,21 +350,55 @@ class ExtractTerms(object):
             print('Removed %d fake (non-russian) terms.' % fake_terms_out)
         return judged_terms
 
+    def add_counts(self, terms, text, quiet=True):
+        """ Дописать к количествам (`count`) готовых кандидатов `terms` их употребления в тексте `text`
+            (строка или список предложений), посчитанные так же, как в `__call__`: кандидаты текста извлекаются
+            rutermextract по окнам и фильтруются по стоп-словам, а количество каждого прибавляется к кандидату,
+            с которым он объединился бы в `join_terms` - с той же нормальной формой или с совпадающим шаблоном лемм.
+            Кандидаты, не подходящие ни к одному из `terms`, не добавляются (для них нужно извлечение заново).
+            returns количество учтённых употреблений """
+        by_normalized = {t.normalized: t for t in reversed(terms)}  # первый кандидат с такой нормальной формой
+        # (длина фразы, лемма первого слова) -> кандидаты в порядке списка - как groups_by_lemma в `join_terms`
+        by_lemma = {}
+        for t in terms:
+            for lemma in (t.lemmas[0]  if t.lemmas else  (None,)):
+                by_lemma.setdefault((len(t.lemmas), lemma), []).append(t)
+
+        new_terms = self.filter_by_stopwords(merge_terms(self.extract_windows(text)))
+        counted = 0
+        for new in new_terms:
+            target = by_normalized.get(new.normalized)
+            if target is None:
+                pattern = tuple(set(p.normal_form for p in self.morph_parse(str(word))) for word in new.words)
+                first_lemmas = pattern[0]  if pattern else  (None,)
+                matched = {id(t): t for lemma in first_lemmas for t in by_lemma.get((len(pattern), lemma), ())}
+                target = next((t for t in terms if id(t) in matched and lemma_patterns_match(pattern, t.lemmas)), None)
+            if target is not None:
+                target.count += new.count
+                counted += new.count
+        if not quiet:
+            print('Counted %d occurrences of %d term candidates in the new text.' % (counted, len(terms)))
+        return counted
+
     def get_lemmatizer(self, extracted_terms):
         return Lemmatizer(self.morph, extracted_terms, self._morph_parse_cache)
 
     def morph_parse(self, word):
-        if word in self._morph_parse_cache:
-            return self._morph_parse_cache[word]
-        
-        hyps = self.morph.parse(word)
-        # update cache
-        self._morph_parse_cache[word] = hyps
-        return hyps
+        " -> tuple of ParseRecord (гипотезы разбора pymorphy2) "
+        return self._morph_parse_cache.parse(word)
             
         
-    def clear_cahe(self):
-        self._morph_parse_cache.clear()
+    def clear_cache(self):
+        """ Очистить кеш этого экземпляра (ответы про стоп-слова).
+            Кеш разборов pymorphy2 общий на процесс (Lemmatizer, Evaluator, word_family...),
+            поэтому здесь не очищается - для этого есть `morphology.get_parse_cache().clear()`. """
+        self._is_stopword_cache.clear()
+
+    clear_cahe = clear_cache  # прежнее имя
+
+    def cache_stats(self):
+        " -> dict: статистика кеша разборов pymorphy2 (hits, misses, evictions, size, maxsize, disk_hits) "
+        return self._morph_parse_cache.stats()
 
     
 
@@ -279,10 +410,10 @@ class Lemmatizer(object):
         """ Инициализировать Лемматизатор
             terms_list - список объектов-терминов, содержащих поле `lemmas` с леммами (каждый)
             morph - экземпляр морфолог. анализаторалл (pymorphy2.Morph) 
-            morph_parse_cache - словарь (dict), содержащий кеш запросов к pymorphy2.Morph.parse(). Если задан, то будет использоваться и обновляться, если нет - то не будет создан.
+            morph_parse_cache - кеш запросов к pymorphy2.Morph.parse() (morphology.MorphParseCache). Если не задан, используется общий кеш процесса.
         """
         self.morph = morph
-        self._morph_parse_cache = morph_parse_cache
+        self._morph_parse_cache = morph_parse_cache  if morph_parse_cache is not None else  get_parse_cache(morph)
         self.lemmas = None
         if terms_list:
             self.set_lemmas_from_terms(terms_list)
@@ -305,18 +436,87 @@ class Lemmatizer(object):
     def __call__(self, word):
         return self.lemmatize_word(word)
 
+    def lemmatize_words(self, words, workers=None):
+        """ Лемматизировать сразу много слов (например, весь словарь текста).
+            workers - число процессов для разбора (анализатор загружается до fork и разделяется процессами, кеш разборов на диске общий,
+            поэтому это окупается лишь на больших словарях); по умолчанию разбор идёт в текущем процессе через кеш.
+        returns: list(set(str)) - множества лемм слов в том же порядке """
+        if not workers or workers < 2 or len(words) < workers:
+            return [self.lemmatize_word(w) for w in words]
+
+        chunk_size = max(1, len(words) // (workers * 4))
+        chunks = [words[i:i + chunk_size] for i in range(0, len(words), chunk_size)]
+        preload_morphology()  # до fork: обработчики разделяют словари
+        with multiprocessing.Pool(workers, initializer=_init_lemmatize_worker) as pool:
+            normal_forms = [lemmas_set for chunk_forms in pool.map(_normal_forms_of_words, chunks)
+                            for lemmas_set in chunk_forms]
+        return [lemmas_set.intersection(self.lemmas)  if self.lemmas else  lemmas_set
+                for lemmas_set in normal_forms]
+
     def morph_parse(self, word):
-        
-        if self._morph_parse_cache and word in self._morph_parse_cache:
-            return self._morph_parse_cache[word]
-        
-        hyps = self.morph.parse(word)
-        if self._morph_parse_cache:
-            # update cache
-            self._morph_parse_cache[word] = hyps
-            return hyps
+        return self._morph_parse_cache.parse(word)
     
 
+# кеш разборов процесса-обработчика (см. `Lemmatizer.lemmatize_words`)
+_worker_parse_cache = None
+
+def _init_lemmatize_worker():
+    global _worker_parse_cache
+    _worker_parse_cache = get_parse_cache()
+
+def _normal_forms_of_words(words):
+    normal_forms = [{p.normal_form for p in _worker_parse_cache.parse(str(word))} for word in words]
+    # обработчики пула завершаются без atexit, поэтому новые разборы записываются после каждой пачки
+    _worker_parse_cache.flush()
+    return normal_forms
+
+
+# TermExtractor процесса-обработчика (см. `ExtractTerms.extract_windows`)
+_worker_term_extractor = None
+
+def _init_window_worker():
+    global _worker_term_extractor
+    _worker_term_extractor = make_term_extractor(get_shared_morph())
+
+def _extract_window_terms(window_and_nested):
+    window, nested = window_and_nested
+    return [(t.normalized, tuple(map(str, t.words)), t.count) for t in _worker_term_extractor(window, nested=nested)]
+
+# экземпляр ExtractTerms процесса-обработчика и параметры извлечения (см. `ExtractTerms.extract_many`)
+_worker_extract_terms = None
+_worker_extract_kwargs = None
+
+def _init_extract_worker(stopwords, kwargs):
+    global _worker_extract_terms, _worker_extract_kwargs
+    _worker_extract_terms = ExtractTerms(stopwords=stopwords)
+    _worker_extract_kwargs = kwargs
+
+def _extract_terms_of(indexed_text):
+    i, text = indexed_text
+    result = _worker_extract_terms(text, **_worker_extract_kwargs)
+    get_parse_cache().flush()  # обработчики пула завершаются без atexit
+    return i, result
+
+
+def merge_terms(term_lists):
+    """ Слить списки кандидатов в термины (например, из окон текста) по нормальной форме:
+        количества складываются, остаётся первый встреченный экземпляр - как у rutermextract для всего текста сразу.
+    returns list of terms """
+    merged = {}
+    for terms in term_lists:
+        for t in terms:
+            first = merged.get(t.normalized)
+            if first is None:
+                merged[t.normalized] = t
+            else:
+                first.count += t.count
+    return list(merged.values())
+
+
+def lemma_patterns_match(ptt1, ptt2):
+    " совпадают длины шаблонов лемм и для каждого слова есть совпадающие (общие) леммы "
+    return len(ptt1) == len(ptt2) and all([ptt1[i].intersection(ptt2[i]) for i in range(len(ptt1))])
+
 
 def load_wordset(stops_file):
     " Загрузить список слов, например стоп-слова "
@@ -329,17 +529,115 @@ def load_wordset(stops_file):
         return None
 
 
-def copyTerm(objTerm):
-    "Construct new instance of rutermextract.term_extractor.Term"
-    return rutermextract.term_extractor.Term(
+# подкласс rutermextract.parser.Parser (создаётся при первом вызове `make_term_extractor`, т.к. rutermextract загружается отложенно)
+_SharedMorphParser = None
+
+def make_term_extractor(morph):
+    """ -> rutermextract.TermExtractor, разбирающий слова анализатором morph
+        (стандартный rutermextract.parser.Parser загружает собственную копию словарей pymorphy2) """
+    global _SharedMorphParser
+    if _SharedMorphParser is None:
+        class SharedMorphParser(rutermextract.parser.Parser):
+            " Parser с готовым анализатором pymorphy2 "
+            def __init__(self, morph):
+                self.morph = morph
+        _SharedMorphParser = SharedMorphParser
+    return rutermextract.TermExtractor(parser=_SharedMorphParser(morph))
+
+
+class TermRecord(object):
+    """ Кандидат в термины - компактная замена rutermextract.term_extractor.Term с дописанными полями.
+        Слова и леммы хранятся как id словаря `vocabulary` (по умолчанию общего, см. `vocabulary.get_shared_vocabulary`;
+        глава передаёт свой) в общих для одинаковых значений кортежах; объекты pymorphy2 не хранятся.
+        Поля `words` (строки) и `lemmas` (кортеж множеств строк) доступны как прежде.
+        Равенство и хеш - по `normalized`, как у Term; для сравнения по леммам есть ключ `signature()`.
+    """
+    __slots__ = ('normalized', 'word_ids', 'lemma_ids', 'count', 'term_inidices', 'vocabulary')
+
+    def __init__(self, words=(), normalized='', count=0, lemmas=None, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else get_shared_vocabulary()
+        self.normalized = normalized
+        self.word_ids = self.vocabulary.intern_ids(self.vocabulary.ids_of(map(str, words)))
+        self.lemma_ids = None  # tuple(tuple(id леммы)) - по кортежу id лемм на каждое слово
+        self.count = count
+        if lemmas is not None:
+            self.lemmas = lemmas
+
+    @classmethod
+    def from_term(cls, term, lemmas=None, vocabulary=None):
+        """ Term (или TermRecord) -> новый TermRecord; lemmas - леммы вместо леммы `term`;
+            vocabulary - по умолчанию словарь `term` (если это TermRecord) """
+        if lemmas is None:
+            lemmas = getattr(term, 'lemmas', None)
+        if vocabulary is None:
+            vocabulary = getattr(term, 'vocabulary', None)
+        return cls(term.words, term.normalized, term.count, lemmas, vocabulary)
+
+    @property
+    def words(self):
+        return tuple(self.vocabulary.words(self.word_ids))
+
+    @property
+    def word_count(self):
+        return len(self.word_ids)
+
+    @property
+    def lemmas(self):
+        if self.lemma_ids is None:
+            raise AttributeError("'TermRecord' object has no lemmas yet")
+        vocabulary = self.vocabulary
+        return tuple(set(vocabulary.words(ids)) for ids in self.lemma_ids)
+
+    @lemmas.setter
+    def lemmas(self, lemmas):
+        vocabulary = self.vocabulary
+        self.lemma_ids = vocabulary.intern_ids(vocabulary.intern_ids(sorted(vocabulary.ids_of(group))) for group in lemmas)
+
+    def signature(self):
+        """ Ключ для сравнения терминов по леммам: `lemma_ids`, а пока леммы не заданы - `normalized`
+            (id сравнимы только у терминов одного словаря) """
+        return self.normalized  if self.lemma_ids is None else  self.lemma_ids
+
+    def __eq__(self, other):
+        return self.normalized == other.normalized
+
+    def __hash__(self):
+        return hash(self.normalized)
+
+    def __str__(self):
+        return self.normalized
+
+    def __repr__(self):
+        return 'TermRecord(%r, count=%d)' % (self.normalized, self.count)
+
+    def __reduce__(self):
+        # id действительны только в словаре этого процесса, поэтому сохраняются строки
+        lemmas = None  if self.lemma_ids is None else  tuple(tuple(sorted(l)) for l in self.lemmas)
+        return _restore_term_record, (self.words, self.normalized, self.count, lemmas,
+                                      getattr(self, 'term_inidices', None))
+
+
+def _restore_term_record(words, normalized, count, lemmas, term_inidices):
+    t = TermRecord(words, normalized, count, lemmas)
+    if term_inidices is not None:
+        t.term_inidices = term_inidices
+    return t
+
+
+def copyTerm(objTerm, vocabulary=None):
+    """Construct new TermRecord with words, normalized form and count of the term (lemmas are not copied).
+    vocabulary - по умолчанию словарь `objTerm` (если это TermRecord)"""
+    return TermRecord(
         words=objTerm.words,
         normalized=objTerm.normalized,
-        count=objTerm.count)
+        count=objTerm.count,
+        vocabulary=vocabulary if vocabulary is not None else getattr(objTerm, 'vocabulary', None))
 
-def makeTerm(words=[], normalized="", count=0):
-    "Construct new instance of rutermextract.term_extractor.Term"
-    return rutermextract.term_extractor.Term(
+def makeTerm(words=[], normalized="", count=0, vocabulary=None):
+    "Construct new TermRecord"
+    return TermRecord(
         words=words,
         normalized=normalized,
-        count=count)
+        count=count,
+        vocabulary=vocabulary)
 
@@ -0,0 +1,29 @@
+# coding=utf-8
+
+import importlib
+import importlib.util
+import os
+import sys
+
+
+def lazy_module(name):
+    """ Импорт модуля, откладывающий его загрузку до первого обращения к атрибутам (importlib.util.LazyLoader).
+        Тяжёлые пакеты (pandas, pymorphy2, rutermextract) тогда не замедляют запуск скриптов,
+        которым они не понадобились (например, `main_run.py --help`).
+        Переменная окружения RUS_TERM_EAGER_IMPORTS=1 возвращает обычный импорт (см. bench_startup.py).
+    returns: module """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if os.environ.get('RUS_TERM_EAGER_IMPORTS'):
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named '%s'" % name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -3,7 +3,8 @@
 import argparse
 import os
 
-from text_utils import *
+# text_utils (numpy, pandas, pymorphy2...) импортируется только когда нужно обрабатывать текст:
+#  так `--help` и ошибки в параметрах не ждут загрузки тяжёлых пакетов
 
 def parse_cmdline():
     """Parses command line arguments and returns an object with fields (of type string):
@@ -12,8 +13,12 @@ def parse_cmdline():
         query             (for -q option)
         limit             (for -l option)
     """
+    return make_arg_parser().parse_args()
+
+def make_arg_parser(description='Extract terms in Russian from a textfile'):
+    " -> argparse.ArgumentParser with options of the script (shared with term_client.py) "
     parser = argparse.ArgumentParser(
-        description='Extract terms in Russian from a textfile'
+        description=description
     )
     parser.add_argument("PATH", # "-p",
                         help="Textfile path")
@@ -32,9 +37,17 @@ def parse_cmdline():
                         type=int,
                         help="Keep only first L terms for bootstrapping further intersection of algorithm (default: no limit)",
                         required=False)
-    args = parser.parse_args()
+    return parser
 
-    return args
+def check_args(args):
+    " -> error message or None "
+    try:
+        assert args.limit is None or args.limit > 0, "limit parameter must be positive, but %s provided" % str(args.limit)
+        assert args.min_count > 0, "min_count parameter must be positive, but %s provided" % str(args.min_count)
+        assert all({v > 0 for v in args.sent_by_part}), "sent_by_part parameter must contain positive intrgers only, but it does not: %s" % str(args.sent_by_part)
+    except Exception as e:
+        return str(e)
+    return None
 
 def prepare_dir(dir):
     """Checks the path and creates a directory if nesessary.
@@ -55,15 +68,20 @@ def prepare_dir(dir):
             terminate_with_error("directory is not accessible or writable: "+dir)
 
 
-def process_text(txt, sent_by_part_list=[40], min_count=None, sieve_limit=50):
-    """ process_text(txt, min_count=2, sent_by_part_list=[40], min_count=5, sieve_limit=50)
-    -> sorted list[str]   """
-    work_chapter = Chapter()
+def process_text(txt, sent_by_part_list=[40], min_count=None, sieve_limit=50, work_chapter=None):
+    """ process_text(txt, min_count=2, sent_by_part_list=[40], min_count=5, sieve_limit=50, work_chapter=None)
+    -> sorted list[str]
+    If `txt` is None, the text already loaded into `work_chapter` is processed.   """
+    from text_utils import Chapter
+
+    work_chapter = work_chapter or Chapter()
     results = work_chapter.run_on_text(txt, sent_by_part_list, min_count=min_count, limit=sieve_limit)
     
     if not results:
         print('Cannot extract anything!')
-        print('   Text size:        ', len(txt) // 1024, 'KB')
+        # текст главы может быть не сохранён (load_file(keep_text=False)) - тогда считаем по строкам предложений
+        text_size = len(txt or work_chapter.text or '') or sum(len(s.line or '') for s in work_chapter.sentence_list)
+        print('   Text size:        ', text_size // 1024, 'KB')
         print('   Sentences found:  ', len(work_chapter.sentence_list))
         print('   Sentences by part:', sent_by_part_list)
         print('Pass bigger text or decrease numbers in `sent_by_part` parameter!')
@@ -73,36 +91,58 @@ def process_text(txt, sent_by_part_list=[40], min_count=None, sieve_limit=50):
     for k in results.keys():
         print('\t', k)
         
+    print("Intersecting", len(results), "rankings ...")
+    common_terms = intersect_rankings(results)
+    print(len(common_terms), "terms remaining after intersection")
+    
+    return common_terms
+
+
+def intersect_rankings(results):
+    """ results: dict(name -> list of tuples (word, score)), see `Chapter.run_on_text`
+    -> sorted list[str]: words present in all the rankings """
     term_sets = [
         {w for w,_ in ts} for ts in results.values()
     ]
-    print("Intersecting", len(term_sets), "rankings ...")
-        
     common_terms = term_sets[0]
     for s in term_sets[1:]:
         common_terms = common_terms.intersection(s)
-        
-    print(len(common_terms), "terms remaining after intersection")
 
     common_terms = list(common_terms)
     common_terms.sort()
-    
     return common_terms
 
 
+def save_terms(args, terms):
+    """ Write extracted terms into result/ (the name depends on `args`)
+    -> path of the file """
+    save_path = "result/extracted-min%d%s.txt" % (args.min_count, ("-lim%d" % args.limit) if args.limit else "")
+    
+    with open(save_path, "w", newline="", encoding='utf-8') as file:
+        file.write("# Source text: "+args.PATH+"\n")
+        file.write("# Parameters :")
+        file.write( " sent_by_part="+ (','.join(map(str,args.sent_by_part))) )
+        file.write( " limit="+ str(args.limit) )
+        file.write( " min_count="+ str(args.min_count) )
+        file.write("\n")
+        file.write( "# Terms extracted: "+ str(len(terms)) )
+        file.write("\n\n")
+        
+        file.write("\n".join(terms))
+        file.write("\n")
+    return save_path
+
+
 if __name__ == '__main__':
     
     print('\n =========== TERM EXTRACTION START ===========\n')
 
     args = parse_cmdline()
     
-    try:
-        assert args.limit is None or args.limit > 0, "limit parameter must be positive, but %s provided" % str(args.limit)
-        assert args.min_count > 0, "min_count parameter must be positive, but %s provided" % str(args.min_count)
-        assert all({v > 0 for v in args.sent_by_part}), "sent_by_part parameter must contain positive intrgers only, but it does not: %s" % str(args.sent_by_part)
-    except Exception as e:
+    error = check_args(args)
+    if error:
         print("Error!")
-        print(e)
+        print(error)
         exit()
 
     prepare_dir("result")
@@ -112,33 +152,25 @@ if __name__ == '__main__':
     for k in ('PATH','sent_by_part','limit','min_count'):
         print(k.rjust(15),":",getattr(args,k))
     
+    from text_utils import Chapter
+
+    work_chapter = Chapter()
     try:
-        with open(args.PATH, "r", encoding='utf-8') as file:
-            txt = file.read()
+        # файл читается потоково, предложения разбираются по мере чтения;
+        #  весь текст не хранится - кандидаты извлекаются по окнам из строк предложений
+        work_chapter.load_file(args.PATH, keep_text=False)
+        text_size = os.path.getsize(args.PATH)
     except Exception as e:
         print("Error!")
         print(e)
         exit()
         
-    print(len(txt) // 1024, 'kBytes of text loaded.')
+    print(text_size // 1024, 'kBytes of text loaded.')
     print()
     
-    terms = process_text(txt, sent_by_part_list=args.sent_by_part, min_count=args.min_count, sieve_limit=args.limit)
+    terms = process_text(None, sent_by_part_list=args.sent_by_part, min_count=args.min_count, sieve_limit=args.limit, work_chapter=work_chapter)
     
-    save_path = "result/extracted-min%d%s.txt" % (args.min_count, ("-lim%d" % args.limit) if args.limit else "")
-    
-    with open(save_path, "w", newline="", encoding='utf-8') as file:
-        file.write("# Source text: "+args.PATH+"\n")
-        file.write("# Parameters :")
-        file.write( " sent_by_part="+ (','.join(map(str,args.sent_by_part))) )
-        file.write( " limit="+ str(args.limit) )
-        file.write( " min_count="+ str(args.min_count) )
-        file.write("\n")
-        file.write( "# Terms extracted: "+ str(len(terms)) )
-        file.write("\n\n")
-        
-        file.write("\n".join(terms))
-        file.write("\n")
+    save_path = save_terms(args, terms)
     
     print('Saved result:', save_path)
 
@@ -0,0 +1,266 @@
+# coding=utf-8
+
+import atexit
+from collections import namedtuple, OrderedDict
+import os
+import sqlite3
+import sys
+import threading
+
+from lazy_import import lazy_module
+
+pymorphy2 = lazy_module('pymorphy2')
+
+
+# Гипотеза морфологического разбора - то, что используется из pymorphy2.Parse (кешируется на диске)
+ParseRecord = namedtuple('ParseRecord', 'word normal_form tag score')
+
+# Файл общего кеша разборов; переменная окружения RUS_TERM_MORPH_CACHE задаёт другой путь,
+#  пустое значение отключает кеш на диске (остаётся только кеш в памяти процесса)
+MORPH_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'rus-term', 'morph-parse.sqlite')
+
+# сколько словоформ держать в памяти процесса (остальные - только на диске)
+MORPH_CACHE_MAXSIZE = 100000
+
+
+class LRUCache(object):
+    """ Ограниченный по размеру кеш (ключ -> значение) с вытеснением давно не использованных записей (LRU).
+        Считает попадания, промахи и вытеснения - см. `stats()`, по ним удобно подбирать размер.
+    """
+
+    def __init__(self, maxsize=None):
+        " maxsize - наибольшее число записей (None - без ограничения) "
+        assert maxsize is None or maxsize > 0
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        " -> значение по ключу (запись становится самой свежей) или default; считает попадание/промах "
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        " очистить записи (счётчики сохраняются) "
+        self._data.clear()
+
+    def stats(self):
+        " -> dict: hits, misses, evictions, size, maxsize "
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self._data), maxsize=self.maxsize)
+
+
+class MorphParseCache(object):
+    """ Кеш результатов pymorphy2.MorphAnalyzer.parse(): словоформа -> кортеж ParseRecord.
+        Двухуровневый: LRU-кеш в памяти процесса и база SQLite на диске, общая для всех запусков и процессов.
+        База открыта в режиме WAL, поэтому несколько процессов-обработчиков могут читать её одновременно
+        (запись выполняется пачками, по одному писателю за раз).
+        Экземпляр можно использовать из нескольких потоков (например, в term_server.py): соединение с базой общее,
+        а промахи кеша в памяти и запись в базу выполняются под блокировкой.
+        Разборы привязаны к версии словаря pymorphy2: при смене словаря база очищается.
+        В памяти хранится не более maxsize словоформ (LRU) в компактном виде: (нормальная форма, id тега, оценка).
+    """
+
+    def __init__(self, morph=None, path=None, flush_every=500, maxsize=MORPH_CACHE_MAXSIZE):
+        """ morph - экземпляр pymorphy2.MorphAnalyzer для слов, которых нет в кеше (по умолчанию - общий, см. `get_shared_morph`);
+            path - путь к файлу базы (None: MORPH_CACHE_FILE или RUS_TERM_MORPH_CACHE; '' - без базы на диске);
+            flush_every - сколько новых разборов копить в памяти перед записью в базу;
+            maxsize - сколько словоформ держать в памяти (None - без ограничения).
+        """
+        self.morph = morph or get_shared_morph()
+        self.path = os.environ.get('RUS_TERM_MORPH_CACHE', MORPH_CACHE_FILE)  if path is None else  path
+        self.flush_every = flush_every
+        self._memory = LRUCache(maxsize)  # словоформа -> tuple((normal_form, tag_id, score[, word]))
+        self._tags = {}      # строка тега -> id тега
+        self._tag_list = []  # id тега -> объект тега (один экземпляр на тег)
+        self.disk_hits = 0   # разборы, найденные в базе (промахи кеша в памяти, не дошедшие до pymorphy2)
+        self._pending = []  # новые разборы, ещё не записанные в базу
+        self._db = None
+        self._pid = None
+        self._lock = threading.RLock()  # соединение, _pending и таблица тегов
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, word):
+        return word in self._memory
+
+    def parse(self, word):
+        """ returns tuple of ParseRecord (same as morph.parse(word), but without pymorphy2 methods) """
+        compact = self._memory.get(word)
+        if compact is None:
+            with self._lock:
+                hyps = self._load(word)
+                if hyps is None:
+                    hyps = tuple(ParseRecord(p.word, p.normal_form, p.tag, p.score) for p in self.morph.parse(word))
+                    self._store(word, hyps)
+                else:
+                    self.disk_hits += 1
+                compact = self._memory[word] = self._compact(word, hyps)
+        tags = self._tag_list
+        return tuple(ParseRecord(h[3]  if len(h) > 3 else  word, h[0], tags[h[1]], h[2]) for h in compact)
+
+    def clear(self):
+        " очистить кеш в памяти (база на диске остаётся) "
+        self.flush()
+        self._memory.clear()
+
+    def stats(self):
+        " -> dict: hits, misses, evictions, size, maxsize (кеш в памяти) и disk_hits "
+        stats = self._memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        return stats
+
+    def flush(self):
+        " записать накопленные разборы в базу "
+        with self._lock:
+            if not self._pending:
+                return
+            db = self._connection()
+            if db is not None:
+                try:
+                    with db:
+                        db.executemany('INSERT OR REPLACE INTO parses (word, hyps) VALUES (?, ?)', self._pending)
+                except sqlite3.Error as e:
+                    print("Warning. MorphParseCache.flush(): %s" % e)
+            self._pending = []
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    def _tag_id(self, tag_str, tag=None):
+        t_i = self._tags.get(tag_str)
+        if t_i is None:
+            t_i = self._tags[tag_str] = len(self._tag_list)
+            self._tag_list.append(tag or self.morph.TagClass(tag_str))
+        return t_i
+
+    def _compact(self, word, hyps):
+        # словоформа гипотезы почти всегда совпадает с запрошенной - тогда её не храним
+        return tuple((sys.intern(p.normal_form), self._tag_id(str(p.tag), p.tag), p.score)  if p.word == word else
+                     (sys.intern(p.normal_form), self._tag_id(str(p.tag), p.tag), p.score, p.word)
+                     for p in hyps)
+
+    def _connection(self):
+        " -> sqlite3.Connection or None (если база отключена или недоступна) "
+        if not self.path:
+            return None
+        if self._pid != os.getpid():
+            # после fork соединение родителя использовать нельзя, а его несохранённые разборы запишет он сам
+            self._db = None
+            self._pending = []
+            self._pid = os.getpid()
+            try:
+                self._db = self._open(self.path)
+            except (sqlite3.Error, OSError) as e:
+                print("Warning. MorphParseCache: cannot open %s (%s), using memory only." % (self.path, e))
+        return self._db
+
+    def _open(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # соединение общее для потоков процесса (обращения к нему - под self._lock)
+        db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS parses (word TEXT PRIMARY KEY, hyps TEXT)')
+            version = dictionary_version(self.morph)
+            row = db.execute("SELECT value FROM meta WHERE key = 'dictionary'").fetchone()
+            if row is None or row[0] != version:
+                db.execute('DELETE FROM parses')
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dictionary', ?)", (version,))
+        return db
+
+    def _load(self, word):
+        db = self._connection()
+        if db is None:
+            return None
+        try:
+            row = db.execute('SELECT hyps FROM parses WHERE word = ?', (word,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        hyps = []
+        for line in row[0].split('\n')  if row[0] else  ():
+            p_word, normal_form, tag_str, score = line.split('\t')
+            hyps.append(ParseRecord(p_word, normal_form, self._tag_list[self._tag_id(tag_str)], float(score)))
+        return tuple(hyps)
+
+    def _store(self, word, hyps):
+        if not self.path:
+            return
+        # по строке на гипотезу: словоформа, нормальная форма, тег, оценка (repr сохраняет float точно)
+        self._pending.append((word, '\n'.join('%s\t%s\t%s\t%r' % (p.word, p.normal_form, p.tag, p.score) for p in hyps)))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+
+def dictionary_version(morph):
+    " -> строка, идентифицирующая словарь pymorphy2 "
+    meta = morph.dictionary.meta
+    return '%s/%s/%s' % (meta.get('format_version'), meta.get('source_revision'), meta.get('compiled_at'))
+
+
+# Общие на процесс анализатор и кеш разборов: используются всеми модулями
+#  (ExtractTerms и его TermExtractor, Lemmatizer, Evaluator, word_family, definition_pattern),
+#  так что словари pymorphy2 загружаются в процессе один раз.
+_shared_morph = None
+_shared_parse_cache = None
+
+def get_shared_morph():
+    """ -> общий на процесс pymorphy2.MorphAnalyzer (загружается при первом вызове) """
+    global _shared_morph
+    if _shared_morph is None:
+        _shared_morph = pymorphy2.MorphAnalyzer()
+    return _shared_morph
+
+def get_parse_cache(morph=None):
+    """ -> общий на процесс MorphParseCache.
+        morph - анализатор для создания кеша (по умолчанию общий; если кеш уже создан, не используется). """
+    global _shared_parse_cache
+    if _shared_parse_cache is None:
+        _shared_parse_cache = MorphParseCache(morph)
+        atexit.register(_shared_parse_cache.close)
+    return _shared_parse_cache
+
+def preload_morphology():
+    """ Загрузить общие анализатор и кеш разборов заранее - перед созданием пула процессов:
+        при fork обработчики получают уже загруженные словари и делят их страницы памяти (copy-on-write).
+    returns MorphParseCache """
+    get_shared_morph()
+    return get_parse_cache()
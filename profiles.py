@@ -0,0 +1,266 @@
+# coding=utf-8
+
+import numpy as np
+
+from text_index import SENTENCE_SHIFT
+
+
+class TermCountMatrix(object):
+    """ Разреженная матрица количеств вхождений "термины × предложения" в формате CSR.
+        Строка i соответствует i-му термину из списка, по которому построена матрица,
+        столбец - номеру предложения.
+    """
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = indptr    # np.ndarray[int64] длины n_terms+1
+        self.indices = indices  # np.ndarray[int64] - номера предложений (возрастают внутри строки)
+        self.data = data        # np.ndarray[int64] - количества вхождений
+        self.shape = shape      # (n_terms, n_sentences)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def row(self, i):
+        """ returns dense np.ndarray[int] of counts of i-th term for each sentence """
+        st, end = self.indptr[i], self.indptr[i + 1]
+        profile = np.zeros(self.shape[1], dtype=np.int64)
+        profile[self.indices[st:end]] = self.data[st:end]
+        return profile
+
+    def row_indices(self):
+        """ returns np.ndarray[int] - row (term) index for each stored value """
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def totals(self):
+        """ returns np.ndarray[int] - total count of each term """
+        return np.bincount(self.row_indices(), weights=self.data, minlength=self.shape[0]).astype(np.int64)
+
+    def toarray(self):
+        """ returns dense np.ndarray of shape (n_terms, n_sentences) """
+        dense = np.zeros(self.shape, dtype=np.int64)
+        dense[self.row_indices(), self.indices] = self.data
+        return dense
+
+    def to_scipy(self):
+        """ returns scipy.sparse.csr_matrix (requires scipy) """
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def build_count_matrix(index, terms):
+    """ Построить матрицу количеств вхождений для всех терминов `terms` разом по позиционному индексу `index` (TextIndex).
+        Элементы `terms` - термины, строки или коллекции из них (как для `TextIndex.postings`).
+        returns TermCountMatrix """
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    indices = []
+    data = []
+    for i, t in enumerate(terms):
+        sentences = index.postings(t) >> SENTENCE_SHIFT
+        # номера предложений с количествами вхождений в каждое
+        cols, counts = np.unique(sentences, return_counts=True)
+        indices.append(cols)
+        data.append(counts)
+        indptr[i + 1] = indptr[i] + len(cols)
+
+    return TermCountMatrix(
+        indptr=indptr,
+        indices=np.concatenate(indices).astype(np.int64)  if indices else  np.empty(0, dtype=np.int64),
+        data=np.concatenate(data).astype(np.int64)  if data else  np.empty(0, dtype=np.int64),
+        shape=(len(terms), index.sentence_count))
+
+
+# Движок сжатия профилей. Текст рассматривается как шкала "слов":
+# предложение i расположено в точке ends[i] - сквозном номере его последнего слова (см. `word_offsets`).
+# Шкала делится на интервалы по `interval` слов, начиная с конца первого предложения,
+# и количества вхождений предложений одного интервала суммируются.
+
+def word_offsets(weights):
+    """ Сквозные номера последних слов предложений (накопленные длины предложений).
+        returns np.ndarray[int64] """
+    return np.cumsum(np.asarray(weights, dtype=np.int64))
+
+def bin_interval(ends, parts):
+    """ Длина интервала (в словах) для сжатия текста до `parts` фрагментов """
+    assert parts > 0
+    return max(1, -(-int(ends[-1]) // parts))  # ceil
+
+def bin_sentences(ends, parts):
+    """ Номер фрагмента для каждого предложения.
+        returns tuple(np.ndarray[int64] bins, int nbins) """
+    bins = (ends - ends[0]) // bin_interval(ends, parts)
+    return bins, int(bins[-1]) + 1
+
+def bin_starts(ends, parts):
+    """ Номер первого предложения каждого фрагмента (для пустого фрагмента - номер первого предложения следующего).
+        returns np.ndarray[int64] of length nbins """
+    interval = bin_interval(ends, parts)
+    nbins = int((ends[-1] - ends[0]) // interval) + 1
+    edges = ends[0] + interval * np.arange(nbins, dtype=np.int64)
+    return np.searchsorted(ends, edges, side='left')
+
+def compress_counts(counts, ends, parts):
+    """ Сжать плотный профиль (или матрицу профилей: по строке на термин) до фрагментов.
+        counts: np.ndarray of shape (..., n_sentences)
+        returns np.ndarray of shape (..., nbins) """
+    counts = np.asarray(counts)
+    starts = bin_starts(ends, parts)
+    compressed = np.add.reduceat(counts, starts, axis=-1)
+    # reduceat для пустого фрагмента возвращает значение следующего предложения - обнуляем
+    empty = np.append(starts[1:] == starts[:-1], False)
+    compressed[..., empty] = 0
+    return compressed
+
+def compress_matrix(matrix, ends, parts):
+    """ Сжать все строки разреженной матрицы TermCountMatrix до фрагментов разом.
+        returns dense np.ndarray[int64] of shape (n_terms, nbins) """
+    bins, nbins = bin_sentences(ends, parts)
+    return compress_matrix_by_bins(matrix, bins, nbins)
+
+def compress_matrix_by_bins(matrix, bins, nbins):
+    """ Сжать строки TermCountMatrix по готовому разбиению: `bins` - номер фрагмента для каждого предложения.
+        returns dense np.ndarray[int64] of shape (n_terms, nbins) """
+    flat = matrix.row_indices() * nbins + bins[matrix.indices]
+    compressed = np.bincount(flat, weights=matrix.data, minlength=matrix.shape[0] * nbins)
+    return compressed.astype(np.int64).reshape(matrix.shape[0], nbins)
+
+
+class PrefixCounts(object):
+    """ Накопленные (префиксные) суммы вхождений всех терминов TermCountMatrix вдоль текста.
+        Считаются один раз; после этого сжатие профилей до любого числа фрагментов
+        сводится к выборке сумм на границах фрагментов и не зависит от длины текста.
+
+        Текст может дописываться (`extend`): суммы хранятся сегментами по последовательным
+        диапазонам предложений, и соседние сегменты сливаются, когда последний дорастает до предыдущего
+        (как разряды двоичного счётчика). Сегментов остаётся O(log n), а дописывание стоит O(размер дописанного)
+        в среднем.
+    """
+
+    def __init__(self, matrix):
+        self.shape = (matrix.shape[0], 0)
+        self.segments = []  # (номер первого предложения, число предложений, ключи, накопленные суммы)
+        self.extend(matrix)
+
+    @staticmethod
+    def _segment(first, matrix):
+        n_sentences = matrix.shape[1]
+        # сквозной ключ (строка, предложение) - возрастает по всей матрице
+        keys = matrix.row_indices() * n_sentences + matrix.indices
+        cumsum = np.concatenate(([0], np.cumsum(matrix.data)))
+        return first, n_sentences, keys, cumsum
+
+    @staticmethod
+    def _segment_matrix(segment, n_terms):
+        """ TermCountMatrix по сегменту (столбцы - номера предложений внутри сегмента) """
+        _first, n_sentences, keys, cumsum = segment
+        rows = keys // n_sentences  if n_sentences else  keys
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=n_terms))
+        return TermCountMatrix(indptr=indptr,
+                               indices=keys - rows * n_sentences,
+                               data=np.diff(cumsum),
+                               shape=(n_terms, n_sentences))
+
+    def _merge(self, a, b):
+        """ Слить два соседних сегмента в один """
+        n_terms = self.shape[0]
+        ma, mb = self._segment_matrix(a, n_terms), self._segment_matrix(b, n_terms)
+        n_sentences = a[1] + b[1]
+        keys = np.concatenate((ma.row_indices() * n_sentences + ma.indices,
+                               mb.row_indices() * n_sentences + mb.indices + a[1]))
+        order = np.argsort(keys, kind='stable')
+        data = np.concatenate((ma.data, mb.data))[order]
+        return a[0], n_sentences, keys[order], np.concatenate(([0], np.cumsum(data)))
+
+    def extend(self, matrix):
+        """ Дописать вхождения следующих предложений текста:
+            `matrix` - TermCountMatrix по тем же терминам (в том же порядке) и новым предложениям """
+        assert matrix.shape[0] == self.shape[0]
+        if self.segments and not matrix.shape[1]:
+            return
+        n_terms, n_sentences = self.shape
+        self.segments.append(self._segment(n_sentences, matrix))
+        self.shape = (n_terms, n_sentences + matrix.shape[1])
+        while len(self.segments) > 1 and self.segments[-1][1] >= self.segments[-2][1]:
+            b = self.segments.pop()
+            a = self.segments.pop()
+            self.segments.append(self._merge(a, b))
+
+    def to_matrix(self):
+        """ returns TermCountMatrix over all sentences """
+        segment = self.segments[0]
+        for b in self.segments[1:]:
+            segment = self._merge(segment, b)
+        return self._segment_matrix(segment, self.shape[0])
+
+    def binned(self, starts):
+        """ Суммы вхождений по фрагментам, заданным номерами первых предложений `starts`.
+            returns np.ndarray[int64] of shape (n_terms, len(starts)) """
+        n_terms, n_sentences = self.shape
+        edges = np.append(starts, n_sentences)
+        rows = np.arange(n_terms, dtype=np.int64)[:, None]
+        binned = np.zeros((n_terms, len(starts)), dtype=np.int64)
+        for first, seg_sentences, keys, cumsum in self.segments:
+            # границы фрагментов внутри сегмента
+            local = np.clip(edges - first, 0, seg_sentences)
+            queries = rows * seg_sentences + local[None, :]
+            prefix = cumsum[np.searchsorted(keys, queries, side='left')]
+            binned += np.diff(prefix, axis=1)
+        return binned
+
+    def compress(self, ends, parts):
+        """ То же, что `compress_matrix(matrix, ends, parts)`, но через префиксные суммы """
+        return self.binned(bin_starts(ends, parts))
+
+
+def term_lengths(terms):
+    """ returns np.ndarray[int] - number of words in each term """
+    return np.array([len(t.words) for t in terms], dtype=np.int64)
+
+def stdev_ranks(compressed, lengths):
+    """ Веса терминов: среднеквадратическое отклонение сжатого профиля каждого термина
+        (одна редукция по строкам матрицы "термины × фрагменты"),
+        умноженное на длину термина в словах (повышаем вес многословных терминов).
+        returns np.ndarray[float] """
+    return compressed.std(axis=1, ddof=1) * lengths
+
+
+# Корреляции профилей.
+
+def prepare_profiles4corr(profiles, treshold4part, treshold4text):
+    """ То же, что `prepare_df4corr`, но для матрицы профилей (по строке на слово или семейство):
+        значения меньше `treshold4part` обнуляются, а строки с суммой меньше `treshold4text` отбрасываются.
+        returns tuple(np.ndarray of kept row indices, np.ndarray of kept rows) """
+    profiles = np.where(profiles >= treshold4part, profiles, 0)
+    kept = np.flatnonzero(profiles.sum(axis=1) >= treshold4text)
+    return kept, profiles[kept]
+
+def corr_edges(profiles, treshold, block_size=1024, dtype=np.float32):
+    """ Пары строк матрицы `profiles` (n × n_parts) с корреляцией Пирсона больше `treshold`.
+        Строки нормируются один раз, а матрица корреляций считается умножением матриц (BLAS)
+        блоками по `block_size` строк, так что целиком она в памяти не хранится.
+        Строки с нулевой дисперсией ни с чем не коррелируют; диагональ (корреляция строки с собой) не возвращается.
+        returns tuple(np.ndarray i, np.ndarray j, np.ndarray corr) - пары с i < j """
+    z = np.asarray(profiles, dtype=dtype)
+    z = z - z.mean(axis=1, keepdims=True)
+    norms = np.sqrt(np.einsum('ij,ij->i', z, z))
+    valid = norms > 0
+    z[valid] /= norms[valid, None]
+    z[~valid] = 0  # корреляция с такими строками будет 0
+
+    edges_i, edges_j, edges_c = [], [], []
+    n = len(z)
+    for start in range(0, n, block_size):
+        # только верхний треугольник: столбцы начиная с первой строки блока
+        block = z[start:start + block_size] @ z[start:].T
+        rows, cols = np.nonzero(block > treshold)
+        i = rows + start
+        j = cols + start
+        upper = i < j
+        edges_i.append(i[upper])
+        edges_j.append(j[upper])
+        edges_c.append(block[rows[upper], cols[upper]])
+
+    if not edges_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=dtype)
+    return np.concatenate(edges_i), np.concatenate(edges_j), np.concatenate(edges_c)
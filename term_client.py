@@ -0,0 +1,54 @@
+# coding=utf-8
+
+""" Тонкий клиент сервера извлечения терминов (term_server.py) - замена main_run.py для частых запусков:
+    те же параметры и тот же файл результата, но без загрузки анализаторов в каждом процессе.
+
+    $ python term_client.py text-corpus/eloquentJS_ru.txt -s 10 20 30 -m 3 -l 120
+"""
+
+import json
+import urllib.error
+import urllib.request
+
+from main_run import make_arg_parser, check_args, prepare_dir, save_terms
+
+DEFAULT_URL = 'http://127.0.0.1:8765/extract'
+
+
+def request_terms(text, sent_by_part=(40,), min_count=5, limit=None, url=DEFAULT_URL, timeout=None):
+    """ Отправить текст серверу.
+    -> dict: 'terms', 'rankings', 'seconds' (см. `term_server.TermExtractionService.extract`) """
+    body = json.dumps({'text': text, 'sent_by_part': list(sent_by_part), 'min_count': min_count, 'limit': limit},
+                      ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json; charset=utf-8'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise ValueError(json.loads(e.read().decode('utf-8')).get('error', str(e)))
+
+
+if __name__ == '__main__':
+    parser = make_arg_parser('Extract terms in Russian from a textfile using a running term_server.py')
+    parser.add_argument("--url", default=DEFAULT_URL, help="Server address (default: %s)" % DEFAULT_URL)
+    args = parser.parse_args()
+
+    error = check_args(args)
+    if error:
+        print("Error!")
+        print(error)
+        exit()
+
+    prepare_dir("result")
+
+    try:
+        with open(args.PATH, encoding='utf-8') as file:
+            text = file.read()
+        answer = request_terms(text, args.sent_by_part, args.min_count, args.limit, url=args.url)
+    except Exception as e:
+        print("Error!")
+        print(e)
+        exit()
+
+    print(len(answer['terms']), "terms extracted in %.3f s" % answer['seconds'])
+    print('Saved result:', save_terms(args, answer['terms']))
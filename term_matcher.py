@@ -0,0 +1,117 @@
+# coding=utf-8
+
+import numpy as np
+
+from profiles import TermCountMatrix
+from text_index import term_form_ids
+from vocabulary import get_shared_vocabulary
+
+
+class TermMatcher(object):
+    """ Сопоставитель сразу многих терминов с текстом: префиксное дерево (trie), строится один раз по всему списку терминов.
+        Предложение просматривается за один проход, и находятся все вхождения всех терминов -
+        с тем же результатом, что и `Sentence.positions_of_term` для каждого термина по отдельности.
+
+        Позиция термина допускает целое множество id форм (словоформы, нормальные формы, леммы - см. `term_form_ids`),
+        у склеенных терминов - до сотен. Поэтому рёбра дерева помечены не отдельными id, а классами форм
+        (различными множествами id), а для каждого id хранится список классов, в которые он входит.
+        Слово текста несёт несколько id (словоформа и леммы), так что вместо детерминированного
+        автомата Ахо-Корасик с функцией неудач при просмотре хранится множество активных состояний (узел, позиция начала).
+    """
+
+    def __init__(self, terms, vocabulary=None):
+        self.terms = list(terms)
+        self.vocabulary = vocabulary if vocabulary is not None else get_shared_vocabulary()
+        self.goto = [{}]     # узел -> {класс форм -> дочерний узел}
+        self.outputs = [()]  # узел -> индексы терминов, заканчивающихся в узле
+        self.classes = {}    # frozenset(id форм) -> класс форм
+        self.accept = {}     # id формы -> список классов, в которые она входит
+        self.lengths = [len(t.words) for t in self.terms]
+
+        for t_i, term in enumerate(self.terms):
+            self._add_term(t_i, term_form_ids(term, self.vocabulary))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _class_of(self, forms):
+        forms = frozenset(forms)
+        c = self.classes.get(forms)
+        if c is None:
+            c = self.classes[forms] = len(self.classes)
+            for w in forms:
+                self.accept.setdefault(w, []).append(c)
+        return c
+
+    def _add_term(self, t_i, t_forms):
+        if not all(t_forms):
+            return  # какое-то из слов термина не встречается в словаре: термин не может совпасть
+        node = 0
+        for forms in t_forms:
+            c = self._class_of(forms)
+            child = self.goto[node].get(c)
+            if child is None:
+                child = self.goto[node][c] = len(self.goto)
+                self.goto.append({})
+                self.outputs.append(())
+            node = child
+        self.outputs[node] += (t_i,)
+
+    def scan(self, word_ids, lemma_ids=None):
+        """ Найти все вхождения всех терминов в последовательности слов.
+            word_ids: id словоформ; lemma_ids: кортежи id лемм для каждой позиции (или None).
+            returns sorted list of tuples (term_index, start_position) """
+        goto = self.goto
+        outputs = self.outputs
+        accept = self.accept
+        found = []
+        active = []  # (узел, позиция начала)
+        for p, w in enumerate(word_ids):
+            # классы форм, которым соответствует слово
+            token_classes = set(accept.get(w, ()))
+            for lemma in (lemma_ids[p] if lemma_ids else ()):
+                token_classes.update(accept.get(lemma, ()))
+            if not token_classes:
+                active = []
+                continue
+            active.append((0, p))
+            next_active = []
+            for node, start in active:
+                edges = goto[node]
+                if len(edges) < len(token_classes):
+                    children = [child for c, child in edges.items() if c in token_classes]
+                else:
+                    children = [edges[c] for c in token_classes if c in edges]
+                for child in children:
+                    next_active.append((child, start))
+                    for t_i in outputs[child]:
+                        found.append((t_i, start))
+            active = next_active
+        return sorted(found)
+
+    def scan_sentence(self, sentence):
+        """ returns sorted list of tuples (term_index, start_position) for the Sentence """
+        return self.scan(sentence.word_ids, sentence.lemma_ids)
+
+    def count_matrix(self, sentences):
+        """ Матрица количеств вхождений "термины × предложения" за один проход по тексту.
+            returns TermCountMatrix """
+        rows = []
+        cols = []
+        s_i = -1
+        for s_i, sentence in enumerate(sentences):
+            for t_i, _ in self.scan_sentence(sentence):
+                rows.append(t_i)
+                cols.append(s_i)
+        n_terms, n_sentences = len(self.terms), s_i + 1
+
+        keys, counts = np.unique(np.array(rows, dtype=np.int64) * n_sentences + np.array(cols, dtype=np.int64),
+                                 return_counts=True)
+        row_of_key = keys // n_sentences  if n_sentences else  keys
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(row_of_key, minlength=n_terms))
+        return TermCountMatrix(
+            indptr=indptr,
+            indices=(keys - row_of_key * n_sentences).astype(np.int64),
+            data=counts.astype(np.int64),
+            shape=(n_terms, n_sentences))
@@ -0,0 +1,164 @@
+# coding=utf-8
+
+""" Сервер извлечения терминов: держит загруженными анализаторы (pymorphy2, rutermextract) и кеши разборов,
+    принимает тексты по HTTP на локальном адресе и возвращает найденные термины в JSON.
+    Так каждый документ не платит за загрузку словарей, как при запуске main_run.py.
+
+    $ python term_server.py --port 8765
+    $ python term_client.py text-corpus/patterns.txt -s 20 40 -m 3
+
+    POST /extract  {"text": "...", "sent_by_part": [40], "min_count": 5, "limit": null}
+        -> {"terms": [...], "rankings": {"freq": [["word", score], ...], "stdev-40s": [...]}, "seconds": 0.05}
+    GET /health   -> {"status": "ok"}
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import time
+
+from main_run import check_args, intersect_rankings
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Chapter.run_on_text принимает тексты длиннее 100 символов
+MIN_TEXT_LENGTH = 101
+MIN_PARTS = 2  # как в Chapter.run_on_text: меньшее деление на части не ранжируется
+
+
+class TermExtractionService(object):
+    """ Извлечение терминов одним "тёплым" экземпляром ExtractTerms для всех запросов.
+        Каждый текст обрабатывается в новой главе (Chapter) со своим словарём (Vocabulary),
+        чтобы память долгоживущего процесса не росла от документа к документу;
+        общие на процесс кеши (разборы pymorphy2, ответы про стоп-слова) ограничены по размеру (LRU). """
+
+    def __init__(self, stopwords_file='text-corpus/stopwords.txt'):
+        from extract_terms import ExtractTerms
+        self.extract_terms = ExtractTerms(stopwords_file=stopwords_file)  # загружает словари pymorphy2
+
+    def extract(self, text, sent_by_part=(40,), min_count=5, limit=None):
+        """ -> dict: 'terms' - sorted list[str] (как у main_run.py), 'rankings' - dict(name -> list of [word, score])
+            Неверные параметры - ValueError с понятным сообщением. """
+        from text_utils import Chapter
+        from vocabulary import Vocabulary
+
+        sent_by_part = [sent_by_part]  if type(sent_by_part) is int else  sent_by_part
+        error = check_request(text, sent_by_part, min_count, limit)
+        if error:
+            raise ValueError(error)
+        sent_by_part = list(sent_by_part)
+
+        chapter = Chapter(extract_terms_instance=self.extract_terms, vocabulary=Vocabulary(), incremental=True)
+        chapter.load_text(text)
+        parts = [len(chapter) // s_per_part for s_per_part in sent_by_part]
+        if min(parts) < 1 or max(parts) < MIN_PARTS:
+            raise ValueError("Text is too short: %d sentences cannot be split into %d parts of %s sentences. "
+                             "Pass bigger text or decrease numbers in `sent_by_part` parameter."
+                             % (len(chapter), MIN_PARTS, sent_by_part))
+        try:
+            chapter.prepare_terms(quiet=True)
+        except AssertionError:
+            if chapter.has_term_candidates():
+                raise  # внутренняя ошибка, а не свойство текста
+            raise ValueError("No term candidates in the text (all the words seem to be stopwords)")
+        # кандидаты уже подготовлены: в инкрементальном режиме run_on_text их не извлекает повторно
+        results = chapter.run_on_text(None, sent_by_part, min_count=min_count, limit=limit)
+        if not results:
+            raise ValueError("Cannot extract anything! Pass bigger text or decrease numbers in `sent_by_part` parameter.")
+        return {
+            'terms': intersect_rankings(results),
+            'rankings': {name: [[w, float(score)] for w, score in ranked] for name, ranked in results.items()},
+        }
+
+
+def check_request(text, sent_by_part, min_count, limit):
+    " -> error message or None (те же проверки, что у main_run.py, и проверка типов JSON) "
+    if not isinstance(text, str):
+        return "text must be a string, but %s provided" % type(text).__name__
+    if len(text.strip()) < MIN_TEXT_LENGTH:
+        return "text is too short: at least %d characters required, but %d provided" % (MIN_TEXT_LENGTH, len(text.strip()))
+    if not isinstance(sent_by_part, (list, tuple)) or not sent_by_part or not all(_is_int(v) for v in sent_by_part):
+        return "sent_by_part parameter must be a non-empty list of integers, but %s provided" % str(sent_by_part)
+    if not _is_int(min_count):
+        return "min_count parameter must be an integer, but %s provided" % str(min_count)
+    if limit is not None and not _is_int(limit):
+        return "limit parameter must be an integer or null, but %s provided" % str(limit)
+    return check_args(argparse.Namespace(sent_by_part=sent_by_part, min_count=min_count, limit=limit))
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class TermRequestHandler(BaseHTTPRequestHandler):
+    " HTTP-обработчик; `self.server.service` - TermExtractionService "
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'unknown path: ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/extract':
+            self._reply(404, {'error': 'unknown path: ' + self.path})
+            return
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+            text = request['text']
+            params = dict(sent_by_part=request.get('sent_by_part', (40,)),
+                          min_count=request.get('min_count', 5),
+                          limit=request.get('limit'))
+        except KeyError as e:
+            self._reply(400, {'error': 'missing field in request: %s' % e})
+            return
+        except ValueError as e:
+            # неверный JSON
+            self._reply(400, {'error': str(e)})
+            return
+        try:
+            answer = self.server.service.extract(text, **params)
+        except ValueError as e:
+            # неверные параметры или текст, из которого ничего не извлечь
+            self._reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._reply(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+        answer['seconds'] = time.perf_counter() - start
+        self._reply(200, answer)
+
+    def _reply(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, service=None):
+    """ -> HTTPServer (однопоточный: запросы обрабатываются по очереди, т.к. кеши и анализаторы общие) """
+    server = HTTPServer((host, port), TermRequestHandler)
+    server.service = service or TermExtractionService()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve term extraction over local HTTP')
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen (default: %s)" % DEFAULT_HOST)
+    parser.add_argument("--port", "-p", default=DEFAULT_PORT, type=int, help="Port (default: %d)" % DEFAULT_PORT)
+    parser.add_argument("--stopwords", default='text-corpus/stopwords.txt', help="Stopwords file")
+    args = parser.parse_args()
+
+    print('Loading analyzers ...', flush=True)
+    server = make_server(args.host, args.port, TermExtractionService(args.stopwords))
+    print('Serving on http://%s:%d/extract' % (args.host, args.port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
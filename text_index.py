@@ -0,0 +1,187 @@
+# coding=utf-8
+
+import numpy as np
+
+from vocabulary import get_shared_vocabulary
+
+
+# Вхождение (posting) упаковывается в одно целое число:
+#   старшие биты - номер предложения, младшие 32 бита - позиция слова в предложении.
+# Благодаря этому позиция следующего слова того же предложения - это просто `posting + 1`,
+# а фраза никогда не "перескакивает" через границу предложений.
+SENTENCE_SHIFT = 32
+OFFSET_MASK = (1 << SENTENCE_SHIFT) - 1
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def pack_posting(sentence, offset):
+    return (sentence << SENTENCE_SHIFT) | offset
+
+def unpack_postings(postings):
+    """ -> tuple(np.ndarray sentences, np.ndarray offsets) """
+    postings = np.asarray(postings, dtype=np.int64)
+    return postings >> SENTENCE_SHIFT, postings & OFFSET_MASK
+
+def term_form_ids(term, vocabulary):
+    """ Для каждого слова термина - множество id его допустимых форм
+        (нормальная форма, словоформа, леммы), которые есть в словаре.
+        returns list[set(int)] """
+    assert term.words
+    assert term.normalized
+    assert term.lemmas
+
+    n = len(term.words)  # длина фразы [1..*)
+    t_norms = term.normalized.split()
+    # у "несклеенных" фраз бывает одна лемма на всю фразу: ({t.normalized},)
+    t_forms = [{str(term.words[i]),
+                *(t_norms[i:i+1]),
+                *(term.lemmas[i] if i < len(term.lemmas) else ())}
+               for i in range(n)]
+    return [{i for i in map(vocabulary.get, forms) if i is not None} for forms in t_forms]
+
+
+class TextIndex(object):
+    """ Позиционный инвертированный индекс текста (главы или целой книги).
+        Для каждого слова (словоформы) и каждой леммы хранится отсортированный
+        массив упакованных вхождений (предложение, позиция в предложении).
+        Ключи индекса - id строк в словаре `vocabulary`.
+    """
+
+    def __init__(self, sentence_count=0, vocabulary=None):
+        self.words = {}   # id словоформы -> np.ndarray[int64]
+        self.lemmas = {}  # id леммы -> np.ndarray[int64]
+        self.sentence_count = sentence_count
+        self.vocabulary = vocabulary if vocabulary is not None else get_shared_vocabulary()
+        # (0 - слова / 1 - леммы, id) -> буфер с запасом, началом которого является массив вхождений (см. `extend`)
+        self._buffers = {}
+
+    @classmethod
+    def from_sentences(cls, sentences, vocabulary=None):
+        """ Построить индекс за один проход по предложениям (объектам Sentence).
+            Леммы попадают в индекс, только если предложения уже лемматизированы. """
+        words = {}
+        lemmas = {}
+        s_i = -1
+        for s_i, sentence in enumerate(sentences):
+            base = s_i << SENTENCE_SHIFT
+            for offset, w in enumerate(sentence.word_ids):
+                if w in words:
+                    words[w].append(base | offset)
+                else:
+                    words[w] = [base | offset]
+            for offset, token_lemmas in enumerate(sentence.lemma_ids or ()):
+                for lemma in token_lemmas:
+                    if lemma in lemmas:
+                        lemmas[lemma].append(base | offset)
+                    else:
+                        lemmas[lemma] = [base | offset]
+
+        index = cls(sentence_count=s_i + 1, vocabulary=vocabulary)
+        index.words = {k: np.array(v, dtype=np.int64) for k, v in words.items()}
+        index.lemmas = {k: np.array(v, dtype=np.int64) for k, v in lemmas.items()}
+        words.clear()
+        lemmas.clear()
+        return index
+
+    @classmethod
+    def merge(cls, indexes):
+        """ Объединить индексы последовательных фрагментов текста (например, глав книги)
+            в один индекс со сквозной нумерацией предложений. """
+        indexes = list(indexes)
+        merged = cls(vocabulary=indexes[0].vocabulary if indexes else None)
+        words = {}
+        lemmas = {}
+        for index in indexes:
+            assert index.vocabulary is merged.vocabulary, "Indexes must share the same vocabulary"
+            shift = merged.sentence_count << SENTENCE_SHIFT
+            for src, dst in ((index.words, words), (index.lemmas, lemmas)):
+                for k, postings in src.items():
+                    dst.setdefault(k, []).append(postings + shift)
+            merged.sentence_count += index.sentence_count
+        merged.words = {k: np.concatenate(v) for k, v in words.items()}
+        merged.lemmas = {k: np.concatenate(v) for k, v in lemmas.items()}
+        return merged
+
+    def extend(self, sentences):
+        """ Дописать в индекс следующие предложения текста (объекты Sentence).
+            Вхождения дописываются в буферы с запасом (ёмкость удваивается, как в `CorrStatsAccumulator`),
+            поэтому дописывание стоит O(размера новых предложений), а не O(размера всего текста)
+            даже для частых слов. Массивы вхождений индекса - начала этих буферов (без копирования). """
+        delta = TextIndex.from_sentences(sentences, self.vocabulary)
+        shift = self.sentence_count << SENTENCE_SHIFT
+        for kind, src, dst in ((0, delta.words, self.words), (1, delta.lemmas, self.lemmas)):
+            for k, postings in src.items():
+                dst[k] = self._appended((kind, k), dst.get(k), postings + shift)
+        self.sentence_count += delta.sentence_count
+
+    def _appended(self, key, postings, new_postings):
+        """ -> массив вхождений `postings` + `new_postings` (начало буфера `key`) """
+        size = 0  if postings is None else  len(postings)
+        need = size + len(new_postings)
+        buffer = self._buffers.get(key)
+        if buffer is None or len(buffer) < need or postings is None or postings.base is not buffer:
+            # новый буфер с запасом; прежние массивы (у вызывающих) остаются в старом буфере нетронутыми
+            buffer = np.empty(max(need, 2 * size), dtype=np.int64)
+            if size:
+                buffer[:size] = postings
+            self._buffers[key] = buffer
+        buffer[size:need] = new_postings
+        return buffer[:need]
+
+    def postings_of(self, word):
+        """ Вхождения слова-строки: по лемме, а если такой леммы нет - по словоформе
+            (так же, как это делает `Sentence.count_of`). """
+        w_id = self.vocabulary.get(word)
+        if w_id in self.lemmas:
+            return self.lemmas[w_id]
+        return self.words.get(w_id, _EMPTY)
+
+    def postings_of_forms(self, forms):
+        """ Объединение вхождений всех форм (id словоформ и лемм) из `forms` """
+        arrays = [d[w] for w in forms for d in (self.lemmas, self.words) if w in d]
+        if not arrays:
+            return _EMPTY
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.unique(np.concatenate(arrays))
+
+    def positions_of_term(self, term):
+        """ Возвращает упакованные позиции первых слов цепочек, совпавших с поданным термином. """
+        n = len(term.words)  # длина фразы [1..*)
+        positions = None
+        for i, t_forms in enumerate(term_form_ids(term, self.vocabulary)):
+            indices = self.postings_of_forms(t_forms)
+            if positions is None:
+                positions = indices  # для первого слова
+            else:
+                # сдвигаем позиции предыдущего слова на следующее слово и пересекаем
+                positions = np.intersect1d(positions + 1, indices, assume_unique=True)
+            if not positions.size:
+                return _EMPTY
+        return positions - (n - 1)
+
+    def postings(self, word):
+        """ Вхождения для строки, термина или (рекурсивно) коллекции из них.
+            У коллекции вхождения разных элементов не объединяются (могут повторяться). """
+        if hasattr(word, 'lemmas'):
+            # a term passed
+            return self.positions_of_term(word)
+        if type(word) is str:
+            return self.postings_of(word)
+        if type(word) in (set, list, tuple):
+            arrays = [self.postings(w) for w in word]
+            return np.concatenate(arrays) if arrays else _EMPTY
+        else:  # word is of unknown type
+            print('Warning: word is of unknown type:', type(word))
+            return _EMPTY
+
+    def count_of(self, word):
+        """ Количество вхождений слова, термина или коллекции из них """
+        return len(self.postings(word))
+
+    def profile(self, word):
+        """ Количество вхождений по предложениям.
+            returns np.ndarray[int] of length `sentence_count` """
+        sentences = self.postings(word) >> SENTENCE_SHIFT
+        return np.bincount(sentences, minlength=self.sentence_count)
@@ -1,19 +1,53 @@
 # coding=utf-8
 
-import itertools
-import math
+from array import array
 import re
-import pandas as pd
-
-from extract_terms import ExtractTerms
+import numpy as np
+
+from lazy_import import lazy_module
+from extract_terms import ExtractTerms, TermRecord
+from profiles import build_count_matrix, word_offsets, bin_interval, compress_counts, compress_matrix, PrefixCounts
+from profiles import stdev_ranks, term_lengths, prepare_profiles4corr, corr_edges
+from term_matcher import TermMatcher
+from text_index import TextIndex, term_form_ids, unpack_postings
+from vocabulary import get_shared_vocabulary
 # from .extract_terms import ExtractTerms
 
+pd = lazy_module('pandas')  # pandas нужен только для профилей и корреляций
+
 
 text_sep_re = re.compile(r"(?<=[.!?])\s+(?=[A-ZА-ЯЁ])|(?<=\n)\s+(?=[A-ZА-ЯЁ](?![A-ZА-ЯЁ]))")
     # (?=<[.!?]|\n|)
 def extract_sentences_from_text(text):
     return text_sep_re.split(text)
 
+def extract_sentences_from_chunks(chunks):
+    """ Генератор предложений из текста, поданного последовательными кусками (строками).
+        Предложения, разорванные границей кусков, склеиваются, и результат совпадает с
+        `extract_sentences_from_text` для всего текста целиком. """
+    tail = ''
+    for chunk in chunks:
+        buf = tail + chunk
+        start = 0
+        for m in text_sep_re.finditer(buf):
+            # разделителю нужно 2 символа после себя (см. просмотр вперёд в text_sep_re),
+            # иначе у конца куска он может оказаться ложным
+            if m.end() + 2 > len(buf):
+                break
+            yield buf[start:m.start()]
+            start = m.end()
+        tail = buf[start:]
+    # конец текста: остаток делится окончательно
+    yield from text_sep_re.split(tail)
+
+def read_chunks(file, chunk_size=1 << 20):
+    """ Генератор кусков текста из открытого файла """
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
 
 class Position:
     word = 0       # сквозная нумерация слов текста
@@ -28,50 +62,51 @@ sentence_word_re = re.compile(r"(?:[А-ЯЁа-яёA-Za-z](?:[-`']\w+)*)+", flags
 
 class Sentence:
     
-    def __init__(self, line, pos):
+    def __init__(self, line, pos, vocabulary=None):
         self.line = line
-        self.word_list = None
-        self.words_positions = None
+        self.vocabulary = vocabulary if vocabulary is not None else get_shared_vocabulary()
+        self.word_ids = None
         self.beginpos = pos
         self._parse_line()
         # set `end` pos
         self.endpos = Position(pos.word + self.size()-1, pos.sentence)
-        self.lemmas_positions = None
+        self.lemma_ids = None
    
     def _parse_line(self):
-        self.word_list = [w.lower() for w in sentence_word_re.findall(self.line) if len(w)>0]
-        # "перенумеровать" слова позициями
-        self.words_positions = {}
-        for i in range(len(self.word_list)):
-            w = self.word_list[i]
-            if w not in self.words_positions:
-                self.words_positions[w] = [ i ]
-            else:
-                self.words_positions[w] += [ i ]
+        words = [w.lower() for w in sentence_word_re.findall(self.line) if len(w)>0]
+        # слова хранятся компактно - как id словаря (4 байта на слово)
+        self.word_ids = array('I', self.vocabulary.ids_of(words))
+
+    @property
+    def word_list(self):
+        """ Слова предложения (строки в нижнем регистре) """
+        return self.vocabulary.words(self.word_ids)
+
+    def apply_lemma_table(self, lemma_table):
+        """ Взять леммы слов из готовой таблицы `lemma_table`: id слова -> кортеж id лемм
+            (см. `make_lemma_table`). Кортежи лемм не копируются, а разделяются всеми предложениями. """
+        self.lemma_ids = [lemma_table[i] for i in self.word_ids]
 
     def lemmatize_words(self, lemmatizer):
         """find lemmas for all words in the sentence"""
         assert lemmatizer and hasattr(lemmatizer, '__call__')
-        assert self.words_positions
-        
-        # "перенумеровать" леммы позициями
-        self.lemmas_positions = {}
-        for w in self.words_positions:
-            indices = self.words_positions[w]
-            lemmas = lemmatizer(w)
-            for lemma in lemmas:
-                if lemma not in self.lemmas_positions:
-                    self.lemmas_positions[lemma] = indices
-                else:
-                    self.lemmas_positions[lemma] += indices
+        assert self.word_ids
+        
+        # id лемм для каждой позиции предложения (лемматизатор вызывается один раз на уникальное слово)
+        word_lemmas = {}
+        for i in self.word_ids:
+            if i not in word_lemmas:
+                lemmas = lemmatizer(self.vocabulary.word(i))
+                word_lemmas[i] = tuple(self.vocabulary.ids_of(lemmas))
+        self.lemma_ids = [word_lemmas[i] for i in self.word_ids]
 
     def __len__(self):
         """ Количество слов в предложении """
-        return len(self.word_list)
+        return len(self.word_ids)
         
     def size(self):
         """ Количество слов в предложении """
-        return len(self.word_list)
+        return len(self.word_ids)
         
     def count_of(self, word):
         """ Возвращает количество вхождений поданного слова. Универсальная функция,
@@ -81,10 +116,12 @@ class Sentence:
             # a term passed
             return self.count_of_term(word)
         if type(word) is str:
-            for d in (self.lemmas_positions, self.words_positions):
-                if word in d:
-                    return len(d[word])
-            return 0
+            w_id = self.vocabulary.get(word)
+            if w_id is None:
+                return 0
+            # сначала ищем среди лемм, затем - среди словоформ
+            n = sum([1 for lemmas in self.lemma_ids if w_id in lemmas])
+            return n or self.word_ids.count(w_id)
         # ckeck if word is array-like containing strings
             # if bool(word) and isinstance(word[0], str) and not isinstance(word, str):
         if type(word) in (set, list, tuple):
@@ -97,7 +134,8 @@ class Sentence:
         """ Возвращает список кортежей с цепочками слов, совпавших с поданным термином. """
         ps = self.positions_of_term(term)
         n = len(term.words) # длина фразы [1..*)
-        return [tuple(self.word_list[p:p+n]) for p in ps]
+        word_list = self.word_list
+        return [tuple(word_list[p:p+n]) for p in ps]
         
     def count_of_term(self, term):
         """ Возвращает количество цепочек слов, совпавших с поданным термином. """
@@ -105,64 +143,81 @@ class Sentence:
         
     def positions_of_term(self, term):
         """ Возвращает список позиций цепочек слов, совпавших с поданным термином. """
-        assert self.words_positions
-        assert self.lemmas_positions is not None
-        assert term.words
-        assert term.normalized
-        assert term.lemmas
+        assert self.word_ids
+        assert self.lemma_ids is not None
         
-        # найти совпадения со всеми словами термина ...
         n = len(term.words) # длина фразы [1..*)
-        t_norms = term.normalized.split()
-        # все формы слова в соответстие позиции во фразе
-        t_forms = [{t_norms[i], str(term.words[i]), *(term.lemmas[i])} for i in range(n)]
-        
-        positions = None # позиции (в предложении) слов фразы
-        for i in range(n):
-            indices = set() # позиции текущего слова фразы
-            for w in t_forms[i]:
-                for d in (self.lemmas_positions, self.words_positions):
-                    if w in d:
-                        indices.update( d[w] )
-            if positions is None:
-                positions = indices  # для первого слова
-            else:  # для 2-го и далее слов
-                positions = {p+1 for p in positions} # инкрементируем индексы предыдущего слова для совпадения с текущим
-                positions.intersection_update(indices)
-                if not positions: # пересечение пусто
-                    return []
-                
-        if not positions: # пересечение пусто
-            return []
-#         return position) # кол-во "доживших индексов"
-        return sorted([p-n+1 for p in positions]) # список индексов первых слов совпадений со словами предложения
+        # id всех форм слова в соответствие позиции во фразе
+        t_forms = term_form_ids(term, self.vocabulary)
+
+        def word_matches(p, forms):
+            return self.word_ids[p] in forms or not forms.isdisjoint(self.lemma_ids[p])
+
+        # список индексов первых слов совпадений со словами предложения
+        return [p for p in range(len(self.word_ids)-n+1)
+                if all([word_matches(p+i, t_forms[i]) for i in range(n)])]
+
+
+def make_lemma_table(sentences, lemmatizer, vocabulary=None, workers=None, lemma_table=None):
+    """ Таблица лемм словаря предложений: id слова -> кортеж id его лемм.
+        Лемматизатор вызывается один раз на каждое уникальное слово всех предложений
+        (а не на каждое слово текста), пакетом - через `lemmatizer.lemmatize_words`, если он есть.
+        Если подана таблица `lemma_table`, то она дополняется только новыми словами.
+    returns: dict """
+    vocabulary = vocabulary if vocabulary is not None else get_shared_vocabulary()
+    lemma_table = {}  if lemma_table is None else  lemma_table
+    new_ids = sorted(set().union(*(s.word_ids for s in sentences)).difference(lemma_table))
+    words = vocabulary.words(new_ids)
+    if hasattr(lemmatizer, 'lemmatize_words'):
+        lemma_sets = lemmatizer.lemmatize_words(words, workers=workers)
+    else:
+        lemma_sets = map(lemmatizer, words)
+    for i, lemmas in zip(new_ids, lemma_sets):
+        lemma_table[i] = tuple(vocabulary.ids_of(lemmas))
+    return lemma_table
 
 
 class Chapter(object):
     """ Глава """
 
-    def __init__(self, title='NoTitle', text=None, sentences=None, extract_terms_instance=None):
+    def __init__(self, title='NoTitle', text=None, sentences=None, extract_terms_instance=None, vocabulary=None, incremental=False):
         self.sentence_list = sentences or []
         
         # поля для открытого использования
         self.title = title
         self.user_data = None  # (для хранения связаных данных)
         self.text = None
-        
-        if text and type(text) is str:
-            self.load_text(text)
+        self.vocabulary = vocabulary if vocabulary is not None else get_shared_vocabulary()
+        # инкрементальный режим: добавление предложений дописывает кэши, а не сбрасывает их
+        self.incremental = incremental
         
         self.__time_weights_cache = None
         self.__extract_terms = extract_terms_instance or None
         self.__lemmatize = None
         self.__vocabulary_cache = None
         self.__term_candidates_cache = None
+        self.__index_cache = None
+        self.__count_matrix_cache = None
+        self.__candidate_rows = None
+        self.__prefix_counts_cache = None
+        self.__word_offsets_cache = None
+        self.__matcher_cache = None
+        self.__lemma_table = None
+        
+        if text and type(text) is str:
+            self.load_text(text)
     
     def clear_cache(self):
         " reset cached data if any "
         self.__time_weights_cache = None
+        self.__word_offsets_cache = None
         self.__vocabulary_cache = None
         self.__term_candidates_cache = None
+        self.__index_cache = None
+        self.__count_matrix_cache = None
+        self.__candidate_rows = None
+        self.__prefix_counts_cache = None
+        self.__matcher_cache = None
     
     def get_morph(self):
         """ returns pymorphy2 parser instance or None"""
@@ -179,34 +234,164 @@ class Chapter(object):
         assert txt and type(txt) is str
         self.text = txt
         sentence_lines = extract_sentences_from_text(txt)
+        self._load_sentence_lines(sentence_lines, start_position)
+        
+    def load_file(self, path, start_position=None, chunk_size=1 << 20, keep_text=True, keep_lines=True):
+        """ Загрузить текст из файла (UTF-8) потоково: файл читается кусками по `chunk_size` символов,
+            а предложения добавляются в Главу по мере чтения.
+            keep_text: сохранить весь текст в `self.text` (иначе `prepare_terms()` извлекает кандидатов по окнам из строк предложений).
+            keep_lines: сохранить исходные строки предложений в `Sentence.line`.
+            Без них в памяти остаются только id слов предложений. """
+        text_chunks = [] if keep_text else None
+
+        def chunks(file):
+            for chunk in read_chunks(file, chunk_size):
+                if text_chunks is not None:
+                    text_chunks.append(chunk)
+                yield chunk
+
+        with open(path, "r", encoding='utf-8') as file:
+            sentence_lines = extract_sentences_from_chunks(chunks(file))
+            self._load_sentence_lines(sentence_lines, start_position, keep_lines=keep_lines)
+        self.text = ''.join(text_chunks) if keep_text else None
+        
+    def _load_sentence_lines(self, sentence_lines, start_position=None, keep_lines=True):
         # make_chapter_from_sentences ...
         current_pos = start_position or Position()
         self.sentence_list.clear()
+        self.clear_cache()
 
+        for snt in self._make_sentences(sentence_lines, current_pos, keep_lines):
+            self.add_sentence( snt )
+            
+    def _make_sentences(self, sentence_lines, current_pos, keep_lines=True):
+        """ Генератор предложений (Sentence) из строк, нумерация начинается с `current_pos` """
         for line in sentence_lines:
-            snt = Sentence(line, current_pos)
+            snt = Sentence(line, current_pos, self.vocabulary)
+            if not keep_lines:
+                snt.line = None
 
             current_pos = snt.endpos
             current_pos.word += 1
             current_pos.sentence += 1
-
-            self.add_sentence( snt )
+            yield snt
         
     def add_sentence(self, sentence):
         """ Добавить предложение (типа Sentence) в конец Главы """
-        if sentence.size() <= 0:
+        self.add_sentences([sentence])
+        
+    def add_sentences(self, sentences, text=None):
+        """ Добавить предложения (типа Sentence) в конец Главы.
+            В инкрементальном режиме кэши дописываются (см. `_extend_caches`), иначе - сбрасываются.
+            text - исходный текст этих предложений (если строки предложений не сохранены). """
+        sentences = [s for s in sentences if s.size() > 0]
+        if not sentences:
             return
-        self.sentence_list.append(sentence)
+        self.sentence_list.extend(sentences)
         self.beginpos = self.sentence_list[0].beginpos
         self.endpos = self.sentence_list[-1].endpos
-        # reset cached weights if any
-        self.clear_cache()
-        
+        if self.incremental:
+            self._extend_caches(sentences, text)
+        else:
+            # reset cached weights if any
+            self.clear_cache()
+        
+    def append_text(self, txt, keep_lines=True):
+        """ Дописать текст в конец Главы (например, для растущего документа).
+            В инкрементальном режиме (`incremental=True`) подготовленные ранее кандидаты в термины сохраняются,
+            а их количества и профили дописываются - стоимость пропорциональна размеру добавленного текста.
+            Новые кандидаты в термины при этом не ищутся (для этого нужен `prepare_terms()` заново). """
+        assert txt and type(txt) is str
+        if self.sentence_list:
+            current_pos = Position(self.endpos.word + 1, self.endpos.sentence + 1)
+        else:
+            current_pos = Position()
+        if self.text is not None:
+            self.text += '\n' + txt
+        sentence_lines = extract_sentences_from_text(txt)
+        self.add_sentences(self._make_sentences(sentence_lines, current_pos, keep_lines), text=txt)
+        
+    def _extend_caches(self, sentences, text=None):
+        """ Дописать кэши данными о новых предложениях `sentences` (уже добавленных в конец Главы).
+            text - исходный текст этих предложений (по умолчанию - строки предложений). """
+        if self.__lemmatize:
+            # лемматизация нужна для поиска терминов в новых предложениях (лемматизируются только новые слова)
+            self.__lemma_table = make_lemma_table(sentences, self.__lemmatize, self.vocabulary,
+                                                  lemma_table=self.__lemma_table)
+            for sentence in sentences:
+                sentence.apply_lemma_table(self.__lemma_table)
+        weights = [s.size() for s in sentences]
+        if self.__word_offsets_cache is not None:
+            ends = self.__word_offsets_cache
+            last = ends[-1]  if len(ends) else  0
+            self.__word_offsets_cache = np.concatenate((ends, last + word_offsets(weights)))
+        if self.__time_weights_cache is not None:
+            ends = self.word_offsets()[-len(sentences):]
+            self.__time_weights_cache = pd.concat(
+                (self.__time_weights_cache, pd.Series(pd.to_timedelta(ends, unit='s'))), ignore_index=True)
+        if self.__index_cache is not None:
+            self.__index_cache.extend(sentences)
+        if self.__term_candidates_cache and self.__extract_terms:
+            # количества кандидатов считаются так же, как при извлечении (rutermextract), а не по профилям:
+            #  иначе частоты дописанной главы расходились бы с частотами при подготовке заново
+            if text is None and None not in (s.line for s in sentences):
+                text = [s.line for s in sentences]
+            if text is not None:
+                self.__extract_terms.add_counts(self.__term_candidates_cache, text)
+            else:
+                print('Warning: no text of the appended sentences (keep_lines=False?): counts of term candidates are not updated')
+        if self.__term_candidates_cache and (self.__prefix_counts_cache is not None or self.__count_matrix_cache is not None):
+            # вхождения кандидатов в новых предложениях (для профилей)
+            delta = self._get_matcher().count_matrix(sentences)
+            if self.__prefix_counts_cache is None:
+                self.__prefix_counts_cache = PrefixCounts(self.__count_matrix_cache)
+            self.__prefix_counts_cache.extend(delta)
+            # матрица восстанавливается из префиксных сумм по запросу (см. `get_count_matrix`)
+            self.__count_matrix_cache = None
+        
+    def export_prepared_terms(self):
+        """ Подготовленные кандидаты в термины и таблица лемм слов главы - для передачи между процессами
+            (см. `import_prepared_terms`). Кандидаты - TermRecord: они передаются строками (см. `TermRecord.__reduce__`),
+            таблица лемм - тоже строками, т.к. id действительны только в словаре этого процесса.
+            returns tuple(list of TermRecord, dict(word -> tuple of lemmas)) """
+        terms = list(self.get_term_candidates())
+        vocabulary = self.vocabulary
+        lemma_table = {vocabulary.word(i): tuple(vocabulary.words(lemma_ids))
+                       for i, lemma_ids in (self.__lemma_table or {}).items()}
+        return terms, lemma_table
+
+    def import_prepared_terms(self, prepared, extract_terms_instance=None):
+        """ Принять кандидатов в термины и леммы слов, подготовленные для этого же текста
+            (например, в другом процессе - см. `export_prepared_terms`) вместо `prepare_terms()`. """
+        terms, lemma_table = prepared
+        vocabulary = self.vocabulary
+        # распакованные кандидаты ссылаются на общий словарь - переводим их в словарь главы
+        candidates = [t  if t.vocabulary is vocabulary else  TermRecord.from_term(t, vocabulary=vocabulary)
+                      for t in terms]
+        assert candidates, "No significant words it text... (All the words seem to be removed as stopwords)"
+        self.__extract_terms = self.__extract_terms or extract_terms_instance
+        self.__term_candidates_cache = candidates
+        self.__count_matrix_cache = None
+        self.__prefix_counts_cache = None
+        self.__matcher_cache = None
+        if self.__extract_terms:
+            self.__lemmatize = self.__extract_terms.get_lemmatizer(candidates)
+
+        self.__lemma_table = {vocabulary.id_of(w): tuple(vocabulary.ids_of(lemmas))
+                              for w, lemmas in lemma_table.items()}
+        for sentence in self.sentence_list:
+            sentence.apply_lemma_table(self.__lemma_table)
+        self.__index_cache = None
+
     def get_term_candidates(self, limit=None):
         """return term candidates list optionally cropped with limit """
         assert self.__term_candidates_cache, "Run Chapter.prepare_terms() first!"
         return self.__term_candidates_cache[:limit]
         
+    def has_term_candidates(self):
+        """True, если кандидаты извлечены и их список не пуст """
+        return bool(self.__term_candidates_cache)
+        
     def find_terms(self, substr, limit=None, exact_match=False):
         """ получить термы по полному совпадению или по части слова """
         assert limit is None or limit > 0
@@ -241,29 +426,78 @@ class Chapter(object):
         assert self.__extract_terms
         return self.__extract_terms.stopwords
         
-    def prepare_terms(self, stopwords_file=None, quiet=False):
+    def prepare_terms(self, stopwords_file=None, quiet=False, window_size=None, workers=None, extract_terms_instance=None):
         """Init term candidates and sentences for getting profiles"""
-        self.prepare_term_candidates(stopwords_file=stopwords_file, quiet=quiet)
+        self.prepare_term_candidates(stopwords_file=stopwords_file, quiet=quiet, window_size=window_size, workers=workers,
+                                     extract_terms_instance=extract_terms_instance)
         self.lemmatize_sentences()
         
-    def prepare_term_candidates(self, stopwords_file=None, quiet=False):
-        """Extract nominal groups from the text"""
-        assert self.text
-        self.__extract_terms = self.__extract_terms or ExtractTerms(
+    def prepare_term_candidates(self, stopwords_file=None, quiet=False, window_size=None, workers=None, extract_terms_instance=None):
+        """Extract nominal groups from the text.
+        window_size, workers - извлекать по окнам текста (см. `ExtractTerms.__call__`).
+        extract_terms_instance - ExtractTerms для главы без своего (например, общий для всех глав книги).
+        Если текст не сохранён (`load_file(keep_text=False)`), кандидаты извлекаются по окнам из строк предложений."""
+        source = self.text
+        if not source:
+            source = [s.line for s in self.sentence_list]
+            assert source and None not in source, "No text to extract terms from (was the Chapter loaded with keep_text=False and keep_lines=False?)"
+        self.__extract_terms = self.__extract_terms or extract_terms_instance or ExtractTerms(
                 stopwords_file=stopwords_file or ('text-corpus/stopwords.txt')
             )
-        self.__term_candidates_cache = self.__extract_terms(self.text, quiet=quiet)
+        self.__term_candidates_cache = self.__extract_terms(source, quiet=quiet, window_size=window_size, workers=workers,
+                                                           vocabulary=self.vocabulary)
+        self.__count_matrix_cache = None
+        self.__prefix_counts_cache = None
+        self.__matcher_cache = None
         assert self.__term_candidates_cache, "No significant words it text... (All the words seem to be removed as stopwords)"
         
-    def lemmatize_sentences(self):
-        """Make a vocabulary from the text"""
+    def lemmatize_sentences(self, workers=None):
+        """Make a vocabulary from the text.
+        Each unique word of the text is lemmatized once (optionally with a pool of `workers` processes)."""
         assert self.__extract_terms
         assert self.__term_candidates_cache
         self.__lemmatize = self.__lemmatize or self.__extract_terms.get_lemmatizer(self.__term_candidates_cache)
         
-        # пройти по всем предложениям и лемматизировать все слова в них
+        # лемматизировать словарь текста, затем раздать леммы всем предложениям
+        self.__lemma_table = make_lemma_table(self.sentence_list, self.__lemmatize, self.vocabulary, workers=workers)
         for sentence in self.sentence_list:
-            sentence.lemmatize_words(lemmatizer=self.__lemmatize)
+            sentence.apply_lemma_table(self.__lemma_table)
+        # леммы изменились - индекс нужно перестроить
+        self.__index_cache = None
+        self.__count_matrix_cache = None
+        self.__prefix_counts_cache = None
+
+    def get_index(self):
+        """returns TextIndex (positional index) built over all sentences of the Chapter"""
+        if self.__index_cache is None:
+            self.__index_cache = TextIndex.from_sentences(self.sentence_list, self.vocabulary)
+        return self.__index_cache
+
+    def get_count_matrix(self):
+        """returns TermCountMatrix (terms × sentences) for all term candidates at once.
+            Row `i` corresponds to `get_term_candidates()[i]`."""
+        if self.__count_matrix_cache is None:
+            candidates = self.get_term_candidates()
+            if self.__prefix_counts_cache is not None:
+                # текст дописывался в инкрементальном режиме
+                self.__count_matrix_cache = self.__prefix_counts_cache.to_matrix()
+            else:
+                # все кандидаты ищутся за один проход по тексту
+                self.__count_matrix_cache = self._get_matcher().count_matrix(self.sentence_list)
+            self.__candidate_rows = {id(t): i for i, t in enumerate(candidates)}
+        return self.__count_matrix_cache
+
+    def _get_matcher(self):
+        """returns TermMatcher compiled for all term candidates"""
+        if self.__matcher_cache is None:
+            self.__matcher_cache = TermMatcher(self.get_term_candidates(), self.vocabulary)
+        return self.__matcher_cache
+
+    def get_prefix_counts(self):
+        """returns PrefixCounts - cumulative counts of all term candidates along the text"""
+        if self.__prefix_counts_cache is None:
+            self.__prefix_counts_cache = PrefixCounts(self.get_count_matrix())
+        return self.__prefix_counts_cache
             
             
     def run_on_text(self, txt, sentences_per_part_list=None, parts_list=None, min_count=1, limit=None):
@@ -288,7 +522,8 @@ class Chapter(object):
                 Если все варианты не подойдут, то вместо пустого списка вернётся None.
 
         txt (str):
-            текст для обработки
+            текст для обработки.
+            Если None, то обрабатывается уже загруженный текст (например, через `load_file()`).
         sentences_per_part_list - list(int) или int:
             сжимать до фрагментов так, чтобы они содержали указанное число предложений
         parts_list - list(int) или int:
@@ -300,13 +535,15 @@ class Chapter(object):
             не рассматривать кандидатов в термины, которые употребляются реже, чем min_count.
             
         """
-        assert txt and len(txt) > 100
-        assert min_count > 0
-        assert limit is None or limit > 0
+        assert txt is None or len(txt) > 100, "Text is too short: more than 100 characters required"
+        assert min_count > 0, "min_count parameter must be positive, but %s provided" % str(min_count)
+        assert limit is None or limit > 0, "limit parameter must be positive, but %s provided" % str(limit)
         assert sentences_per_part_list or parts_list
         
         # загружаем текст, чтобы уже иметь кол-во предложений в нём
-        self.load_text(txt)
+        if txt is not None:
+            self.load_text(txt)
+        assert self.sentence_list, "No text loaded"
         
         def s_per_part2parts(self, s_per_part):
             return len(self) // s_per_part
@@ -317,7 +554,8 @@ class Chapter(object):
         if sentences_per_part_list:
             # преобразовать sentences_per_part_list в parts_list ...
             sentences_per_part_list = ([sentences_per_part_list]  if (type(sentences_per_part_list) is int) else  sentences_per_part_list)
-            assert all([s_per_part > 0 for s_per_part in sentences_per_part_list])
+            assert all([s_per_part > 0 for s_per_part in sentences_per_part_list]), \
+                "sentences_per_part_list must contain positive integers only, but it does not: %s" % str(sentences_per_part_list)
             
             parts_and_suffices = [
                     (s_per_part2parts(self,s_per_part), '-%ds' % s_per_part)
@@ -330,7 +568,8 @@ class Chapter(object):
                     for parts in parts_list
                 ]
         
-        assert all([parts > 0 for parts,_suffix in parts_and_suffices])
+        assert all([parts > 0 for parts,_suffix in parts_and_suffices]), \
+            "Text is too short: %d sentences cannot be split into parts of %s sentences" % (len(self), str(sentences_per_part_list or parts_list))
         
 
         MIN_PARTS = 2
@@ -343,7 +582,12 @@ class Chapter(object):
             return None # !!!  поданы неподходящие этому тексту параметры (слишком короткий текст)
         
         res_dict = dict()
-        self.prepare_terms()
+        if not (self.incremental and self.__term_candidates_cache and txt is None):
+            self.prepare_terms()
+        # (в инкрементальном режиме уже подготовленные кандидаты и их профили переиспользуются)
+        # профили всех кандидатов сжимаются разом для всех вариантов деления на части
+        compressed = self.compress_candidates4parts([parts for parts,_suffix in parts_and_suffices])
+        lengths = term_lengths(self.get_term_candidates())
         
         print('freq', end=' ...\t')
         freq_terms = [(t.normalized, t.count) 
@@ -358,8 +602,9 @@ class Chapter(object):
 
         for parts,suffix in parts_and_suffices:
             print('stdev'+suffix, '(%dp)' % parts, end='...  ')
-            std_ranked = [( t.normalized, self.term_stdev_rank(t, parts) )
-                          for t in self.get_term_candidates() 
+            ranks = stdev_ranks(compressed[parts], lengths)
+            std_ranked = [( t.normalized, r )
+                          for t,r in zip(self.get_term_candidates(), ranks)
                           if t.count >= min_count]
 
             std_ranked = std_ranked[:limit]
@@ -382,17 +627,31 @@ class Chapter(object):
         return sum([s.size() for s in self.sentence_list])
         
     def count_of(self, word):
-        return sum([s.count_of(word) for s in self.sentence_list])
-        # ckecks if word is an array
+        return self.get_index().count_of(word)
+        
+    def positions_of_term(self, term):
+        """ Возвращает список кортежей (индекс предложения, позиция в предложении)
+            для цепочек слов, совпавших с поданным термином. """
+        sentences, offsets = unpack_postings(self.get_index().positions_of_term(term))
+        return list(zip(sentences.tolist(), offsets.tolist()))
         
     def raw_profile(self, word):
-        "returns list[float]"
-        return [s.count_of(word) for s in self.sentence_list]
+        "returns np.ndarray[int] - count of word for each sentence"
+        if self.__count_matrix_cache is not None and id(word) in self.__candidate_rows:
+            # кандидат в термины - профиль уже посчитан в матрице
+            return self.__count_matrix_cache.row(self.__candidate_rows[id(word)])
+        return self.get_index().profile(word)
         
     def raw_weights(self):
         "returns list[float]"
         return [s.size() for s in self.sentence_list]
 
+    def word_offsets(self):
+        "returns np.ndarray[int64] - through number of the last word of each sentence (cumulative lengths)"
+        if self.__word_offsets_cache is None:
+            self.__word_offsets_cache = word_offsets(self.raw_weights())
+        return self.__word_offsets_cache
+
     def timeSeries_weights(self):
         "returns Series[Timedelta]"
         if self.__time_weights_cache is None:
@@ -405,65 +664,80 @@ class Chapter(object):
         A weight is just a length of a sentence.
         Assume that one word equals to one second of time.
         """
-        start_ts = pd.Timedelta(seconds=0)  # pd.Timestamp(2000, 1, 1)
-        current_ts = start_ts + pd.Timedelta(seconds=0)
-
-        def next_ts(span):
-            nonlocal current_ts
-            current_ts += pd.Timedelta(seconds=span)
-            return current_ts
-
-        return pd.Series(map(next_ts, profile_weights))
+        return pd.Series(pd.to_timedelta(word_offsets(profile_weights), unit='s'))
 
         
     def profile4word_or_family(self, word):  ### , size
         "returns Series[Timedelta -> int]"
-        raw_profile = self.raw_profile(word)
+        raw_profile = self.raw_profile(family_words(word))
         weights_index = self.timeSeries_weights()
-        # Get name from Family instance or first word from array
-        name = ( # isinstance(word, Family) and word.lemma  or
-                hasattr(word, 'normalized') and word.normalized
-                or  bool(word) and type(word) in (set, list, tuple) and str(next(iter(word)))
-                or  'no-name'
-                )
-        word_series = pd.Series(raw_profile, index=weights_index, name=name)
+        word_series = pd.Series(raw_profile, index=weights_index, name=profile_name(word))
         return word_series
         # return self.compress_profile(size, raw_profile,
                                      # self.raw_weights())
 
     def resample_interval(self, parts):
         "returns formatted string like '1000s'"
-        # interval = '30T' # 30 мин
-        # interval = '1000s' # 1000 сек
-        weights_index = self.timeSeries_weights()
-        text_duration = weights_index.iat[-1].seconds  # get seconds of last index (top of Timedelta range [0..duration])
-        sec_span = math.ceil(text_duration / parts)
-        return str(sec_span)+'s'
+        # одно слово - одна "секунда"; считаем в целых словах (без переполнения на длинных текстах)
+        return str(bin_interval(self.word_offsets(), parts))+'s'
 
     def compress_profile(self, parts, word_series):
         """returns pd.Series with index of 'Timedelta's
-        assuming that:   size < word_series.size"""
-        
-        interval = self.resample_interval(parts)
-        return word_series.resample(interval).sum()
+        assuming that:   size < word_series.size
+        `word_series` should be a profile of this chapter (one value per sentence)."""
+        ends = self.word_offsets()
+        compressed = compress_counts(word_series.values, ends, parts)
+        # метки фрагментов - их начала на шкале слов (как у resample)
+        labels = ends[0] + bin_interval(ends, parts) * np.arange(len(compressed))
+        return pd.Series(compressed, index=pd.to_timedelta(labels, unit='s'), name=word_series.name)
+
+    def compress_candidates(self, parts):
+        """Compress profiles of all term candidates at once.
+        returns np.ndarray of shape (n_candidates, n_parts)"""
+        return compress_matrix(self.get_count_matrix(), self.word_offsets(), parts)
+
+    def compress_candidates4parts(self, parts_list):
+        """Compress profiles of all term candidates for several `parts` values.
+        Cumulative counts are computed once and reused for every partition.
+        returns dict(parts -> np.ndarray of shape (n_candidates, n_parts))"""
+        prefix_counts = self.get_prefix_counts()
+        ends = self.word_offsets()
+        return {parts: prefix_counts.compress(ends, parts) for parts in parts_list}
+
+    def compress_families(self, parts, family_list):
+        """Compress profiles of all families at once (through one sparse count matrix).
+        returns np.ndarray of shape (n_families, n_parts)"""
+        matrix = build_count_matrix(self.get_index(), [family_words(f) for f in family_list])
+        return compress_matrix(matrix, self.word_offsets(), parts)
 
     # собираем сжатые профили в один DataFrame
     def profiles4families(self, parts, family_list):
         """family_list should contain true <class Family> objects with not-empty `lemma` fields.
         returns a DataFrame with compressed profiles for all families."""
-        df = pd.DataFrame()
-        for family in reversed(family_list):
-            s = self.profile4word_or_family(family)
-            s = self.compress_profile(parts, s)
-            ## already done ## s.name = family.lemma or family.words[0]
-            # print(s.name)
-            #  insert before 0th column one more column with data  (mutable operation)
-            df.insert(0, s.name, s)
-        return df
+        compressed = self.compress_families(parts, family_list)
+        ends = self.word_offsets()
+        # метки фрагментов - их начала на шкале слов (как у resample)
+        labels = ends[0] + bin_interval(ends, parts) * np.arange(compressed.shape[1])
+        return pd.DataFrame(compressed.T, index=pd.to_timedelta(labels, unit='s'),
+                            columns=profile_names(family_list))
+
+    def corr_edges4families(self, parts, family_list, corr_treshold=0.6, treshold4part=4, treshold4text=20):
+        """Pairs of families whose compressed profiles correlate above `corr_treshold` (sparse edge list).
+        Profiles are prepared as in `prepare_df4corr`: values below `treshold4part` are zeroed
+        and families with total below `treshold4text` are dropped.
+        returns pd.DataFrame with columns 'w1', 'w2', 'corr' (one row per pair)"""
+        names = np.array(profile_names(family_list), dtype=object)
+        compressed = self.compress_families(parts, family_list)
+        kept, profiles = prepare_profiles4corr(compressed, treshold4part, treshold4text)
+        i, j, corr = corr_edges(profiles, corr_treshold)
+        names = names[kept]
+        return pd.DataFrame({'w1': names[i], 'w2': names[j], 'corr': corr})
 
     # находим корреляции целиковых профилей для семейств
     def corr4families(self, parts, family_list, corr_treshold=0.6):
         """returns correlation matrix for family pairs whose correlation is above `corr_treshold`
+        (families without such pairs are removed; other values are NaN).
+        For many families prefer `corr_edges4families` - it does not build the square matrix.
         Usage of returned DataFrame:
         # get single value: tuple of correlated words pair: ('тип', 'метод'), parts count: 40
         stat_df.at[('тип', 'метод'), 40 ]
@@ -472,57 +746,130 @@ class Chapter(object):
         # slice by range/set of keys: returns DataFrame:
         pd.DataFrame(stat_df, columns=stat_df.columns[:20])"""
         
-        df = self.profiles4families(parts, family_list)
-        print('got profiles for', parts, 'parts.')
-        
-        df = prepare_df4corr(df, treshold4part=4, treshold4text=20) ### ??? вычислять динамически?
-        print('removed columns with leak of useful data')
-        
-        # посчитать корреляцию между профилями для отобранных слов
-        corr_df = df.corr()
-        print('got correlation matrix')
-        
-        # отсеять диагональные единицы
-        corr_df = corr_df[corr_df<1]
-        
-        # corr_max = corr_df.max().max()
-        # corr_min = corr_df.min().min()
-        # # print(corr_max, corr_min) ### info
-        
-        # порог отсева по максимальной корреляции слова с другими в строке
+        edges = self.corr_edges4families(parts, family_list, corr_treshold,
+                                         treshold4part=4, treshold4text=20) ### ??? вычислять динамически?
+        print('got', len(edges), 'correlated pairs for', parts, 'parts.')
+        
+        # в матрице остаются только семейства, у которых есть хотя бы одна пара (в исходном порядке)
+        linked = set(edges['w1']).union(edges['w2'])
+        names = [n for n in profile_names(family_list) if n in linked]
+        position = {n: k for k, n in enumerate(names)}
+        corr = np.full((len(names), len(names)), np.nan)
+        i = edges['w1'].map(position).values.astype(int)
+        j = edges['w2'].map(position).values.astype(int)
+        corr[i, j] = corr[j, i] = edges['corr'].values
+        return pd.DataFrame(corr, index=names, columns=names)
+        
+
+def family_words(family):
+    """ Слова семейства (word_family.Family) - список; другие объекты (слова, термины, коллекции) возвращаются как есть """
+    if hasattr(family, 'lemma') and hasattr(family, 'words') and not hasattr(family, 'lemmas'):
+        return list(family.words)
+    return family
+
+def profile_name(word):
+    """ Имя профиля: лемма семейства, нормальная форма термина или первое слово коллекции """
+    return (hasattr(word, 'lemma') and not hasattr(word, 'lemmas') and word.lemma
+            or  hasattr(word, 'normalized') and word.normalized
+            or  bool(word) and type(family_words(word)) in (set, list, tuple) and str(next(iter(family_words(word))))
+            or  'no-name'
+            )
 
-        for i1 in corr_df.columns: # ["семейство"]['типам']
-            if corr_df[i1].max() < corr_treshold:
-                corr_df.drop(columns=i1, inplace=True)
-                corr_df.drop(index=i1, inplace=True)
-                print(i1,'\t','removed from correlation matrix (columns & rows)') ### info
-            
-        print('removed columns & rows of low-correlated words')
+def profile_names(family_list):
+    """ Имена профилей семейств (см. `profile_name`) - они становятся ключами строк и столбцов матриц корреляций,
+        поэтому одинаковые имена у разных семейств недопустимы (иначе семейства слились бы в одну строку).
+    returns list of str """
+    names = [profile_name(f) for f in family_list]
+    if len(set(names)) < len(names):
+        seen = set()
+        duplicates = sorted({n for n in names if n in seen or seen.add(n)})
+        raise ValueError('families have the same profile names: %s' % ', '.join(duplicates))
+    return names
+
+
+class CorrStatsAccumulator(object):
+    """ Накопитель статистики корреляций пар семейств для многих вариантов деления текста на `parts` частей.
+        Тройки (пара, parts, корреляция) складываются в заранее выделенные (и удваиваемые при нехватке) массивы,
+        а итоговая таблица "пары × parts" строится один раз - в `to_frame()`.
+        Usage:
+            acc = CorrStatsAccumulator()
+            for parts in parts_list:
+                acc.add(parts, chapter.corr_edges4families(parts, family_list))
+            stat_df = acc.to_frame()
+            stat_df.at[('тип', 'метод'), 40]
+    """
 
-        # remove values below the corr_treshold
-        corr_df = corr_df[corr_df>corr_treshold]
-        
-        return corr_df
-        
+    def __init__(self, capacity=1 << 14):
+        self.__pair_ids = {}   # (w1, w2) -> номер строки
+        self.__parts_ids = {}  # parts -> номер столбца
+        self.__rows = np.empty(capacity, dtype=np.int64)
+        self.__cols = np.empty(capacity, dtype=np.int64)
+        self.__values = np.empty(capacity, dtype=np.float64)
+        self.__size = 0
 
-def add_corr_stats4parts(parts, corr_df, stats_df):
-    """Adds new row indexed with `parts` to `stats_df` and saves values from `corr_df` into it.
-    returns new pd.DataFrame - modified `stats_df`."""
+    def __len__(self):
+        return self.__size
 
-    idx_list = []
-    val_list = []
-    
-    for word_pair in itertools.combinations(corr_df.index, 2):
-        w1,w2 = word_pair
-        idx_list.append(word_pair)
-        val = corr_df.loc[w1].loc[w2]
-        val_list.append(val)
+    def _reserve(self, n):
+        """ Обеспечить место ещё для `n` троек (ёмкость удваивается) """
+        need = self.__size + n
+        capacity = len(self.__values)
+        if need <= capacity:
+            return
+        while capacity < need:
+            capacity *= 2
+        self.__rows = self._grown(self.__rows, self.__size, capacity)
+        self.__cols = self._grown(self.__cols, self.__size, capacity)
+        self.__values = self._grown(self.__values, self.__size, capacity)
+
+    @staticmethod
+    def _grown(array, size, capacity):
+        grown = np.empty(capacity, dtype=array.dtype)
+        grown[:size] = array[:size]
+        return grown
+
+    def add(self, parts, corr):
+        """ Добавить корреляции для деления на `parts` частей.
+            corr - список рёбер (pd.DataFrame со столбцами 'w1', 'w2', 'corr', см. `Chapter.corr_edges4families`)
+            или квадратная матрица корреляций (см. `Chapter.corr4families`, значения NaN пропускаются). """
+        if {'w1', 'w2', 'corr'}.issubset(corr.columns):
+            w1, w2, values = corr['w1'].values, corr['w2'].values, corr['corr'].values
+        else:
+            # верхний треугольник матрицы: пары в порядке индекса (как itertools.combinations)
+            names = corr.index.values
+            i, j = np.triu_indices(len(names), 1)
+            values = corr.values[i, j]
+            present = ~np.isnan(values)
+            w1, w2, values = names[i[present]], names[j[present]], values[present]
+
+        pair_ids = self.__pair_ids
+        rows = [pair_ids.setdefault(pair, len(pair_ids)) for pair in zip(w1, w2)]
+        col = self.__parts_ids.setdefault(parts, len(self.__parts_ids))
+
+        n = len(rows)
+        self._reserve(n)
+        st, end = self.__size, self.__size + n
+        self.__rows[st:end] = rows
+        self.__cols[st:end] = col
+        self.__values[st:end] = values
+        self.__size = end
+
+    def to_frame(self):
+        """ returns pd.DataFrame: rows - word pairs (tuples), columns - `parts` values, NaN where a pair is not correlated """
+        table = np.full((len(self.__pair_ids), len(self.__parts_ids)), np.nan)
+        size = self.__size
+        table[self.__rows[:size], self.__cols[:size]] = self.__values[:size]
+        index = pd.MultiIndex.from_tuples(list(self.__pair_ids))  if self.__pair_ids else  None
+        return pd.DataFrame(table, index=index, columns=list(self.__parts_ids))
 
-    s = pd.Series(name=parts, data=val_list, index=idx_list).dropna()
-    #     print(s)
-    stats_df = stats_df.append(s)
-        
-    return stats_df
+
+def add_corr_stats4parts(parts, corr_df, stats_df):
+    """Adds new row indexed with `parts` to `stats_df` and saves values from `corr_df` into it.
+    returns new pd.DataFrame - modified `stats_df`.
+    For many `parts` values prefer CorrStatsAccumulator - it builds the table once."""
+    acc = CorrStatsAccumulator(capacity=max(1, len(corr_df)))
+    acc.add(parts, corr_df)
+    return pd.concat([stats_df, acc.to_frame().T])
 
 
 
@@ -551,21 +898,21 @@ def prepare_df4corr(dataframe, treshold4part, treshold4text):
     return df
 
 
-def should_exclude(word):
-#! uses outer variable `stopwords`
-    wlen = len(word)
-    for stopw in stopwords:
-        if abs(len(stopw) - wlen) > 2:
-            continue
-        if distance_between(word, stopw) < 0.7:
-            print(word, '\t', end='')
-            return True
+def should_exclude(word, stopwords):
+    """ Похоже ли слово на одно из стоп-слов (distance_between < 0.7 при разнице длин не больше 2).
+        stopwords - WordIndex (см. word_family) или коллекция стоп-слов (тогда индекс строится при каждом вызове). """
+    from word_family import WordIndex  # (python-Levenshtein - необязательная зависимость)
+    index = stopwords  if isinstance(stopwords, WordIndex) else  WordIndex(stopwords)
+    if index.has_close(word, 0.7, max_len_diff=2):
+        print(word, '\t', end='')
+        return True
     return False
 
-def create_filtered_vocabulary(iterable_words, min_word_length=3):
+def create_filtered_vocabulary(iterable_words, stopwords, min_word_length=3):
     " Получить словарь уникальных слов загруженного корпуса "
     # 
     print(len(iterable_words),'total words')
+    stopwords = set(stopwords)
     
     new_vocabulary = set()
     for w in iterable_words:
@@ -575,9 +922,12 @@ def create_filtered_vocabulary(iterable_words, min_word_length=3):
     #
     print(len(new_vocabulary),'unique words in pre-filtered vocabulary')
 
+    # индекс стоп-слов строится один раз на весь словарь
+    from word_family import WordIndex  # (python-Levenshtein - необязательная зависимость)
+    stopwords_index = WordIndex(stopwords)
     print('excluded words:\t', end='')
     for w in set(new_vocabulary):
-        if should_exclude(w):
+        if should_exclude(w, stopwords_index):
             new_vocabulary.remove(w)
     #
     print("\n",len(new_vocabulary),'unique words in filtered vocabulary')
@@ -586,7 +936,7 @@ def create_filtered_vocabulary(iterable_words, min_word_length=3):
 
             
 # # создать и отфильтровать словарь корпуса
-# corpus_vocabulary = create_filtered_vocabulary([w for s in main_chapter.sentence_list for w in s.word_list])
+# corpus_vocabulary = create_filtered_vocabulary([w for s in main_chapter.sentence_list for w in s.word_list], main_chapter.get_stopwords())
     
 
 
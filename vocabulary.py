@@ -0,0 +1,55 @@
+# coding=utf-8
+
+
+class Vocabulary(object):
+    """ Словарь, сопоставляющий строкам (словоформам и леммам) целочисленные id.
+        Каждая строка хранится в одном экземпляре, а предложения и индексы
+        хранят только id слов.
+    """
+
+    def __init__(self):
+        self._ids = {}    # str -> int
+        self._words = []  # int -> str
+        self._id_tuples = {}  # tuple of ids -> тот же кортеж (см. `intern_ids`)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._ids
+
+    def id_of(self, word):
+        """ returns id of the word (the word is added to vocabulary if necessary) """
+        i = self._ids.get(word)
+        if i is None:
+            i = self._ids[word] = len(self._words)
+            self._words.append(word)
+        return i
+
+    def ids_of(self, words):
+        """ returns list of ids for iterable of words (new words are added) """
+        return [self.id_of(w) for w in words]
+
+    def get(self, word, default=None):
+        """ returns id of the word or `default` if the word is not in vocabulary """
+        return self._ids.get(word, default)
+
+    def word(self, i):
+        """ returns string by its id """
+        return self._words[i]
+
+    def words(self, ids):
+        """ returns list of strings by their ids """
+        return [self._words[i] for i in ids]
+
+    def intern_ids(self, ids):
+        """ returns tuple of ids - один экземпляр на одинаковые кортежи (живёт столько же, сколько словарь) """
+        ids = tuple(ids)
+        return self._id_tuples.setdefault(ids, ids)
+
+
+# общий на процесс словарь (по умолчанию используется всеми главами и индексами)
+shared_vocabulary = Vocabulary()
+
+def get_shared_vocabulary():
+    return shared_vocabulary
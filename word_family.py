@@ -3,7 +3,8 @@
 # https://pypi.org/project/python-Levenshtein/
 from Levenshtein import distance as fast_Levenshtein_distance
 import collections
-import pymorphy2
+
+from morphology import get_parse_cache, get_shared_morph
 
 # синглтон для анализатора (не нужно загружать, если не будем использовать)
 pymorphy2_morph = None
@@ -11,7 +12,7 @@ pymorphy2_morph = None
 def get_morph():
 	global pymorphy2_morph
 	if not pymorphy2_morph:
-		pymorphy2_morph = pymorphy2.MorphAnalyzer() # загрузить анализатор
+		pymorphy2_morph = get_shared_morph() # общий анализатор процесса
 	return pymorphy2_morph
 
 
@@ -36,6 +37,107 @@ def distance_between(w1,w2):
 	return min_d / (min(8, len_short) / 3); ### min_d / (len_short / 3);
 	
 
+# Индекс слов для поиска близких (по distance_between) слов без перебора всего списка.
+# Слова раскладываются по корзинам длины, а внутри корзины - по биграммам.
+# Если short (более короткое слово пары) отличается от окна long не более чем на k правок,
+# то каждая правка портит не больше 2 биграмм short, и у слов не меньше |D(short)| - 2k общих различных биграмм.
+# Поэтому distance_between вызывается только для кандидатов, прошедших этот необходимый фильтр.
+class WordIndex:
+	def __init__(self, words=()):
+		self.words = []     # слова в порядке добавления (id слова - номер в списке)
+		self.buckets = {}   # длина -> список id
+		self.postings = {}  # (длина, биграмма) -> список id
+		self.bigram_counts = []  # id -> количество различных биграмм слова
+		self.by_bigram_count = {}  # (длина, количество различных биграмм) -> список id
+		for w in words:
+			self.add(w)
+
+	def __len__(self):
+		return len(self.words)
+
+	def add(self, word):
+		"returns id of the added word"
+		w_id = len(self.words)
+		self.words.append(word)
+		L = len(word)
+		self.buckets.setdefault(L, []).append(w_id)
+		bigrams = word_bigrams(word)
+		self.bigram_counts.append(len(bigrams))
+		self.by_bigram_count.setdefault((L, len(bigrams)), []).append(w_id)
+		for bg in bigrams:
+			self.postings.setdefault((L, bg), []).append(w_id)
+		return w_id
+
+	def candidates(self, word, max_distance, inclusive=False, max_len_diff=None):
+		""" id слов, которые могут быть ближе `max_distance` к `word` (не ближе, а не дальше - если inclusive).
+			Это надмножество точного ответа, упорядоченное по id (порядку добавления). """
+		lq = len(word)
+		q_bigrams = word_bigrams(word)
+		found = set()
+		for L, bucket in self.buckets.items():
+			if max_len_diff is not None and abs(L - lq) > max_len_diff:
+				continue
+			len_short, len_long = min(L, lq), max(L, lq)
+			if _lengths_too_different(len_short, len_long):
+				# distance_between сразу вернёт длину длинного слова
+				if _passes(len_long, max_distance, inclusive):
+					found.update(bucket)
+				continue
+			k = _max_edits(len_short, max_distance, inclusive)
+			if k < 0:
+				continue
+			# количество общих различных биграмм с каждым словом корзины
+			shared = collections.Counter()
+			for bg in q_bigrams:
+				shared.update(self.postings.get((L, bg), ()))
+			# short - как в distance_between(word, w): при равной длине short - второе слово
+			if lq < L:
+				if len(q_bigrams) <= 2 * k:
+					found.update(bucket)  # фильтр ничего не отсекает
+				else:
+					found.update(w_id for w_id, n in shared.items() if n >= len(q_bigrams) - 2 * k)
+				continue
+			found.update(w_id for w_id, n in shared.items() if n >= self.bigram_counts[w_id] - 2 * k)
+			# слова, у которых может не быть общих биграмм с запросом
+			for count in range(2 * k + 1):
+				found.update(self.by_bigram_count.get((L, count), ()))
+		return sorted(found)
+
+	def find_close(self, word, max_distance, inclusive=False, max_len_diff=None):
+		"generates tuples (id, distance) of words closer than `max_distance` to `word` (in order of addition)"
+		for w_id in self.candidates(word, max_distance, inclusive, max_len_diff):
+			d = distance_between(word, self.words[w_id])
+			if _passes(d, max_distance, inclusive):
+				yield w_id, d
+
+	def has_close(self, word, max_distance, inclusive=False, max_len_diff=None):
+		"returns True if any word is closer than `max_distance` to `word`"
+		return next(self.find_close(word, max_distance, inclusive, max_len_diff), None) is not None
+
+
+def word_bigrams(word):
+	return {word[i:i+2] for i in range(len(word) - 1)}
+
+def _lengths_too_different(len_short, len_long):
+	# те же условия, что в начале distance_between
+	return (len_short < 3)  or  (len_long > 4 + len_short)  or  (len_long > 2 * len_short)
+
+def _passes(d, max_distance, inclusive):
+	return d <= max_distance  if inclusive else  d < max_distance
+
+_max_edits_cache = {}
+
+def _max_edits(len_short, max_distance, inclusive):
+	"наибольшее число правок min_d, при котором distance_between ещё проходит порог (или -1)"
+	key = (len_short, max_distance, inclusive)
+	if key not in _max_edits_cache:
+		k = 0
+		while _passes(k / (min(8, len_short) / 3), max_distance, inclusive):
+			k += 1
+		_max_edits_cache[key] = k - 1
+	return _max_edits_cache[key]
+
+
 # Семейство слов
 class Family:
 	def __init__(self, words = [], lemma=None):
@@ -69,6 +171,10 @@ class Family:
 def make_word_families(dictionary, print_progress=True):
 	families = []
 	max_distance_within_family = 1.0;
+	# Семейство может принять слово, только если его первое слово не дальше max_distance_within_family
+	# (иначе перебор слов семейства сразу прерывается). Поэтому в индексе - первые слова семейств
+	# (id слова = номер семейства), а проверяются только найденные по индексу семейства, в порядке создания.
+	first_words = WordIndex()
 	if print_progress: print('making word families ...\n.', end='')
 	
 	for w in dictionary:
@@ -76,7 +182,8 @@ def make_word_families(dictionary, print_progress=True):
 #         print(w,'...')
 		min_distance_among_families = 999999;
 		min_family_array = None;
-		for family in families:
+		for f_i, _ in first_words.find_close(w, max_distance_within_family, inclusive=True):
+			family = families[f_i]
 			avg_family_distance = 0;
 			min_family_distance = 199;
 			for word_of_family in family:
@@ -103,6 +210,7 @@ def make_word_families(dictionary, print_progress=True):
 			min_family_array.append(w);
 		else:
 			families.append( Family([w]) );
+			first_words.add(w)
 				
 	return families;
 
@@ -114,7 +222,7 @@ def make_word_families(dictionary, print_progress=True):
 def find_lemmas(families):
 	# c = collections.Counter()
 	c = collections.defaultdict(lambda : 0)
-	get_morph()
+	parse_cache = get_parse_cache(get_morph())
 
 	for family in families:
 		# # family_words = family["family"];
@@ -122,7 +230,7 @@ def find_lemmas(families):
 		norm_forms = [] # список кортежей (lemma, score)
 		for word_form in family.words:
 			norms = [(p.normal_form, p.score*(0.7 if {'anim'} in p.tag else 1)) # понижение рейтинга одушевлённых
-					 for p in pymorphy2_morph.parse(word_form)  if {'NOUN'} in p.tag] # and 'sing' in p.tag]
+					 for p in parse_cache.parse(word_form)  if {'NOUN'} in p.tag] # and 'sing' in p.tag]
 	#         print(norms);
 			norm_forms += norms;
 		